@@ -1,8 +1,20 @@
 import os
 import json
 import time
+import queue
+import asyncio
 import logging
+from collections import deque
+from retry import retry
+from concurrent.futures import ThreadPoolExecutor
 from src.pipeline import Pipeline
+from src.agents.agent import RateLimitedError
+
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    _HAS_ORJSON = False
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
@@ -11,31 +23,72 @@ logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 model_name = "gpt-4o"
 patch_attempts = 2
 level = 1
+# 同时在途的样本数（按服务商 QPM 配额调整）
+concurrency = 4
+# 每分钟最多启动的样本数（限的是样本而不是 LLM 请求），只在窗口打满时才等待，避免触发 429 频率限制。
+# 每个样本约发出 1 次定位 + patch_attempts 次补丁请求，实际请求速率约为 samples_per_minute * (1 + patch_attempts)
+samples_per_minute = 12
+# 每写入多少个样本 fsync 一次逐条结果文件
+fsync_every = 8
 
 # 输入和输出路径
 json_path = r"D:\UniDebugger-main\dataset\QuixBugs\QuixBugs-master\quixbugs_data.json"
 patch_output_dir = r"D:\UniDebugger-main\data processing\quixbugs_patches"
 result_output_path = r"D:\UniDebugger-main\data processing\quixbugs_results.json"
+# 逐条追加的中间结果（JSONL），跑完后汇总成 result_output_path
+result_lines_path = os.path.splitext(result_output_path)[0] + ".jsonl"
 
 os.makedirs(patch_output_dir, exist_ok=True)
 
-# 初始化修复管道
-pipe = Pipeline(model_name=model_name,
-                # container_id="local_test",
-                container_id="defects4j_test_container",
-                data_name="quixbugs",
-                refinement=False,
-                level=level)
+# 初始化修复管道：每个并发槽位一条独立管道，避免 agent 状态在样本间互相干扰
+pipes = queue.SimpleQueue()
+for _ in range(concurrency):
+    pipes.put(Pipeline(model_name=model_name,
+                       # container_id="local_test",
+                       container_id="defects4j_test_container",
+                       data_name="quixbugs",
+                       refinement=False,
+                       level=level))
+
+
+
+def load_json(raw):
+    return orjson.loads(raw) if _HAS_ORJSON else json.loads(raw)
+
+
+def dump_json(obj, indent=False):
+    """序列化为 UTF-8 字节；有 orjson 时直接用其 C 实现，否则退回标准库。"""
+    if _HAS_ORJSON:
+        return orjson.dumps(obj, option=(orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS) if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf-8")
+
 
 # 读取数据
-with open(json_path, "r", encoding="utf-8") as f:
-    quixbugs_data = json.load(f)
+with open(json_path, "rb") as f:
+    quixbugs_data = load_json(f.read())
+
+
+def read_code(path):
+    with open(path, encoding="utf-8") as cf:
+        return cf.read()
+
 
-results = {}
-success_count = 0
+# 预先并行读取全部 buggy 代码，LLM 调用期间不再阻塞在磁盘 I/O 上
+with ThreadPoolExecutor(max_workers=16) as ex:
+    codes = dict(zip([s["sample_name"] for s in quixbugs_data],
+                     ex.map(read_code, [s["buggy_file_path"] for s in quixbugs_data])))
 
-# 遍历样本
-for sample in quixbugs_data:
+written = 0
+# 最近一分钟内各样本的启动时间，用于滑动窗口限速
+start_times = deque()
+
+
+@retry(RateLimitedError, tries=4, delay=30, backoff=2)
+def repair_one(sample):
+    """
+    在工作线程中跑单个样本（LLM 调用是阻塞 I/O）。
+    agent 内部重试用尽后仍被限流时抛出 RateLimitedError，整个样本退避后重跑。
+    """
     sample_name = sample["sample_name"]
     buggy_path = sample["buggy_file_path"]
     entry_func = sample["entry_function"]
@@ -50,50 +103,106 @@ for sample in quixbugs_data:
             "checkout_dir": "/defects4j"
         },
         "entry_func": entry_func,
-        "buggy_code": open(buggy_path, encoding="utf-8").read(),
+        "buggy_code": codes[sample_name],
         "failing_test_cases": "No specific test cases available for QuixBugs"
     }
 
     print(f"\n=== Running FixAgent on sample: {sample_name} ===")
+    pipe = pipes.get_nowait()  # 信号量保证此处总有空闲管道
     try:
         success, patch = pipe.level_1_repair(info, re_patch_num=patch_attempts)
+    finally:
+        pipes.put(pipe)
+
+    # 保存补丁到文件夹
+    patch_file_path = os.path.join(patch_output_dir, f"{sample_name}_patch.txt")
+    with open(patch_file_path, "w", encoding="utf-8") as pf:
+        pf.write(patch)
+    return success, patch_file_path
+
+
+async def throttle(rate_lock):
+    """滑动窗口限速：窗口内已启动 samples_per_minute 个样本时，只睡到最早那个样本滑出窗口为止。"""
+    async with rate_lock:
+        while len(start_times) >= samples_per_minute:
+            wait = start_times[0] + 60 - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            start_times.popleft()
+        start_times.append(time.monotonic())
 
-        # 保存补丁到文件夹
-        patch_file_path = os.path.join(patch_output_dir, f"{sample_name}_patch.txt")
-        with open(patch_file_path, "w", encoding="utf-8") as pf:
-            pf.write(patch)
-
-        results[sample_name] = {
-            "success": success,
-            "patch_file": patch_file_path,
-            "error": None
-        }
-
-        if success:
-            success_count += 1
-            print(f"[✓] Plausible patch found for {sample_name}")
-        else:
-            print(f"[✗] No plausible patch for {sample_name}")
-
-    except Exception as e:
-        print(f"[!] Error processing {sample_name}: {e}")
-        results[sample_name] = {
-            "success": False,
-            "patch_file": None,
-            "error": str(e)
-        }
-
-    # ✅ 每处理一个样本就写入 JSON，防止崩溃丢数据
+
+async def run_one(sample, sem, lock, rate_lock, rf):
+    global written
+    sample_name = sample["sample_name"]
+
+    async with sem:
+        await throttle(rate_lock)
+        try:
+            success, patch_file_path = await asyncio.to_thread(repair_one, sample)
+            entry = {
+                "success": success,
+                "patch_file": patch_file_path,
+                "error": None
+            }
+            if success:
+                print(f"[✓] Plausible patch found for {sample_name}")
+            else:
+                print(f"[✗] No plausible patch for {sample_name}")
+
+        except Exception as e:
+            print(f"[!] Error processing {sample_name}: {e}")
+            entry = {
+                "success": False,
+                "patch_file": None,
+                "error": str(e)
+            }
+
+        # ✅ 每处理一个样本追加一行 JSONL，定期 fsync，防止崩溃丢数据
+        async with lock:
+            rf.write(dump_json({"sample": sample_name, **entry}) + b"\n")
+            written += 1
+            if written % fsync_every == 0:
+                rf.flush()
+                os.fsync(rf.fileno())
+
+
+async def main():
+    sem = asyncio.Semaphore(concurrency)
+    lock = asyncio.Lock()
+    rate_lock = asyncio.Lock()
+    with open(result_lines_path, "wb", buffering=1 << 16) as rf:
+        tasks = [run_one(sample, sem, lock, rate_lock, rf) for sample in quixbugs_data]
+        await asyncio.gather(*tasks)
+
+
+def consolidate():
+    """把 JSONL 逐条结果汇总为带 summary 的 JSON 文件。"""
+    results = {}
+    with open(result_lines_path, "rb") as lf:
+        for line in lf:
+            if line.strip():
+                entry = load_json(line)
+                results[entry.pop("sample")] = entry
+
+    success_count = sum(1 for v in results.values() if v["success"])
     results["summary"] = {
         "total": len(quixbugs_data),
         "successful": success_count,
         "success_rate": round(success_count / len(quixbugs_data), 3)
     }
-    with open(result_output_path, "w", encoding="utf-8") as rf:
-        json.dump(results, rf, indent=2, ensure_ascii=False)
-
-    # 避免触发 429 频率限制
-    time.sleep(20)
+    with open(result_output_path, "wb") as rf:
+        rf.write(dump_json(results, indent=True))
+    return results
+
+
+try:
+    asyncio.run(main())
+finally:
+    # 关闭所有管道，落盘其记录文件
+    while not pipes.empty():
+        pipes.get_nowait().close()
+results = consolidate()
 
 print("\n✅ All done. Summary:")
 print(json.dumps(results["summary"], indent=2, ensure_ascii=False))
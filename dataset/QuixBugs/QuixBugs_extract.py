@@ -2,46 +2,40 @@ import os
 import json
 import logging
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    _HAS_ORJSON = False
 
 # 设置日志格式
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
+# 入口函数识别：main 优先，其次第一个 public static 函数
+_MAIN = "public static void main"
+_ENTRY_RE = re.compile(r'public static [\w<>\[\]]+\s+(\w+)\s*\(')
+
 # 路径配置（确保路径存在）
 base_path = r"D:\UniDebugger-main\dataset\QuixBugs\QuixBugs-master"
 buggy_dir = os.path.join(base_path, "java_programs")
 fixed_dir = os.path.join(base_path, "correct_java_programs")
 
-# 验证目录
-if not os.path.isdir(buggy_dir) or not os.path.isdir(fixed_dir):
-    logging.error("Buggy 或 Fixed 目录不存在，请检查路径！")
-    exit(1)
-
-# 获取文件名映射（不带扩展名）
-buggy_files = {os.path.splitext(f)[0]: os.path.join(buggy_dir, f)
-               for f in os.listdir(buggy_dir) if f.endswith(".java")}
-fixed_files = {os.path.splitext(f)[0]: os.path.join(fixed_dir, f)
-               for f in os.listdir(fixed_dir) if f.endswith(".java")}
 
-records = []
-for sample_name, buggy_path in buggy_files.items():
-    if sample_name not in fixed_files:
-        logging.warning(f"缺少修复文件：{sample_name}")
-        continue
-
-    fixed_path = fixed_files[sample_name]
-
-    # 尝试读取代码以确定 entry function
+def process(sample_name, buggy_path, fixed_path):
+    """读取单个 buggy 文件并确定 entry function，构建记录；读取失败返回 None。"""
     entry_function = "main"  # 默认设为 main
     try:
         with open(buggy_path, 'r', encoding='utf-8') as f:
             code = f.read()
     except Exception as e:
         logging.error(f"读取失败：{buggy_path}，错误：{e}")
-        continue
+        return None
 
-    if "public static void main" not in code:
+    if _MAIN not in code:
         # 查找其他 public static 函数
-        match = re.search(r'public static [\w<>\[\]]+\s+(\w+)\s*\(', code)
+        match = _ENTRY_RE.search(code)
         if match:
             entry_function = match.group(1)
         else:
@@ -56,12 +50,47 @@ for sample_name, buggy_path in buggy_files.items():
         "entry_function": entry_function,
         "metadata": {}
     }
-    records.append(record)
     logging.info(f"已处理：{sample_name} (入口函数：{entry_function})")
+    return record
+
+
+def main():
+    # 验证目录
+    if not os.path.isdir(buggy_dir) or not os.path.isdir(fixed_dir):
+        logging.error("Buggy 或 Fixed 目录不存在，请检查路径！")
+        exit(1)
+
+    # 获取文件名映射（不带扩展名）
+    buggy_files = {os.path.splitext(f)[0]: os.path.join(buggy_dir, f)
+                   for f in os.listdir(buggy_dir) if f.endswith(".java")}
+    fixed_files = {os.path.splitext(f)[0]: os.path.join(fixed_dir, f)
+                   for f in os.listdir(fixed_dir) if f.endswith(".java")}
+
+    names, buggy_paths, fixed_paths = [], [], []
+    for sample_name, buggy_path in buggy_files.items():
+        if sample_name not in fixed_files:
+            logging.warning(f"缺少修复文件：{sample_name}")
+            continue
+        names.append(sample_name)
+        buggy_paths.append(buggy_path)
+        fixed_paths.append(fixed_files[sample_name])
+
+    # 逐文件处理互不依赖，交给进程池并行；map 保持输入顺序
+    with ProcessPoolExecutor() as ex:
+        records = [r for r in ex.map(process, names, buggy_paths, fixed_paths, chunksize=8) if r is not None]
+
+    # 保存为 JSON 文件
+    output_path = os.path.join(base_path, "quixbugs_data.json")
+    if _HAS_ORJSON:
+        # orjson 只支持 2 空格缩进，直接写 UTF-8 字节；标准库分支也用 2 空格、\n 换行，输出与环境无关
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(records, option=orjson.OPT_INDENT_2))
+    else:
+        with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            json.dump(records, f, indent=2, ensure_ascii=False)
+
+    logging.info(f"处理完成，共生成 {len(records)} 条记录，保存至：{output_path}")
 
-# 保存为 JSON 文件
-output_path = os.path.join(base_path, "quixbugs_data.json")
-with open(output_path, 'w', encoding='utf-8') as f:
-    json.dump(records, f, indent=4, ensure_ascii=False)
 
-logging.info(f"处理完成，共生成 {len(records)} 条记录，保存至：{output_path}")
+if __name__ == "__main__":
+    main()
@@ -9,13 +9,12 @@ os.makedirs(output_root, exist_ok=True)
 
 bug_names = ["chart_1", "lang_1", "math_1"]
 
-def find_all_java_files(base_dir):
-    java_files = []
+def iter_java_files(base_dir):
+    # 惰性遍历：调用方只取第一个时无需扫完整棵目录树
     for root, _, files in os.walk(base_dir):
         for f in files:
             if f.endswith(".java"):
-                java_files.append(os.path.join(root, f))
-    return java_files
+                yield os.path.join(root, f)
 
 for bug in bug_names:
     print(f"\n📦 正在处理：{bug}")
@@ -28,10 +27,10 @@ for bug in bug_names:
     found_buggy = False
     for path in src_candidates:
         if os.path.exists(path):
-            java_files = find_all_java_files(path)
-            if java_files:
-                shutil.copy(java_files[0], os.path.join(output_dir, "buggy.java"))
-                print(f"  ✅ buggy.java 提取自：{java_files[0]}")
+            first_java = next(iter_java_files(path), None)
+            if first_java is not None:
+                shutil.copyfile(first_java, os.path.join(output_dir, "buggy.java"))
+                print(f"  ✅ buggy.java 提取自：{first_java}")
                 found_buggy = True
                 break
     if not found_buggy:
@@ -40,7 +39,7 @@ for bug in bug_names:
     # 2. patch.diff
     patch_file = os.path.join(input_dir, "patch.diff")
     if os.path.exists(patch_file):
-        shutil.copy(patch_file, os.path.join(output_dir, "patch.diff"))
+        shutil.copyfile(patch_file, os.path.join(output_dir, "patch.diff"))
         print(f"  ✅ patch.diff 拷贝成功")
     else:
         print("  ⚠️ patch.diff 缺失")
@@ -3,10 +3,12 @@ from . import parse
 from . import patch
 from . import utils
 from . import myast
+from . import cache
 
 __all__ = [
     "parse",
     "patch",
     "utils",
     "myast",
+    "cache",
 ]
\ No newline at end of file
@@ -1,38 +1,97 @@
 import os
 import logging
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 from retry import retry
 
 from .agent import Agent, RetryError
 from ..parse import parse_code, parse_exp
-from ..utils import read_yaml
+from ..utils import load_prompts
 from ..prompts.tokens import calculate_token, token_limit
 
 
+_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/repofocus.yaml")
+
 ALLOW_EXT = {".java", ".py", ".cc", ".cpp", ".c", ".cs", ".go", ".kt", ".scala", ".swift", ".rs", ".js", ".ts"}
 
 
+_SCAN_WORKERS = 8
+
+
+def _is_source(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in ALLOW_EXT
+
+
+def _scan_dir(path: str) -> Tuple[List[str], List[str]]:
+    """
+    List (sub-directories, files) of one directory in a single scandir pass. All files are kept,
+    not only sources: the '...' truncation in _build_tree is decided on every file, as os.walk did.
+    """
+    dirs: List[str] = []
+    files: List[str] = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not entry.is_symlink():  # os.walk does not follow links either
+                        dirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+    except OSError:
+        pass
+    return dirs, files
+
+
 def _build_tree(root: str, max_depth: int = 2, max_entries: int = 200) -> str:
     """
     A lightweight, cross-platform 'tree' summary of the source dir.
+    Directories down to max_depth are listed level by level on a thread pool
+    (stopping once max_entries files are known), then rendered depth-first.
     """
     root = os.path.abspath(root)
+    if not os.path.isdir(root):
+        return ""
+
+    listing: Dict[str, Tuple[List[str], List[str]]] = {}
+    level, found = [root], 0
+    with ThreadPoolExecutor(max_workers=_SCAN_WORKERS) as pool:
+        for _ in range(max_depth + 1):
+            if not level or found >= max_entries:
+                break
+            nxt = []
+            for cur, (dirs, files) in zip(level, pool.map(_scan_dir, level)):
+                listing[cur] = (dirs, files)
+                found += sum(1 for f in files if _is_source(f))
+                nxt.extend(os.path.join(cur, d) for d in dirs)
+            level = nxt
+
+    # 渲染：相对路径随栈传递，避免每个目录再做一次 os.path.relpath
     lines: List[str] = []
     n = 0
-    for cur, dirs, files in os.walk(root):
-        depth = cur.replace(root, "").count(os.sep)
-        if depth > max_depth:
-            continue
+    stack = [(root, ".", 0)]
+    while stack:
+        cur, rel, depth = stack.pop()
+        dirs, files = listing[cur] if cur in listing else _scan_dir(cur)
         indent = "  " * depth
-        rel = os.path.relpath(cur, root)
-        lines.append(f"{indent}{'.' if rel == '.' else rel}/")
+        lines.append(f"{indent}{rel}/")
+        # 每层都排序：保证同一项目生成的 prompt 稳定（跨机器、可命中缓存）
         for f in sorted(files):
+            # 预算用完后遇到任何文件（不论是否源码）都截断，与 os.walk 版本一致
             if n >= max_entries:
                 lines.append(f"{indent}  ...")
                 return "\n".join(lines)
-            if os.path.splitext(f)[1].lower() in ALLOW_EXT:
+            if _is_source(f):
                 lines.append(f"{indent}  {f}")
                 n += 1
+        if depth < max_depth:
+            stack.extend(
+                (os.path.join(cur, d), d if depth == 0 else os.path.join(rel, d), depth + 1)
+                for d in reversed(dirs)
+            )
     return "\n".join(lines)
 
 
@@ -73,13 +132,13 @@ class FocusAgent(Agent):
 
         self.core_msg = "\n".join(parts)
 
-        if "coverage_report" in info and calculate_token(self.core_msg + info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
+        if "coverage_report" in info and calculate_token(self.core_msg, info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
             self.core_msg = "Code coverage for failed testcases:\n" + info["coverage_report"] + "\n" + self.core_msg
 
     @retry((RetryError,), tries=3, delay=5)
     def run(self, info: dict, *args, top_k: int = 5, **kwargs):
         logging.info("## Running FocusAgent...")
-        prompts = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/repofocus.yaml"))
+        prompts = load_prompts(_PROMPT_PATH)
         if self.core_msg is None:
             self._generate_core_msg(info)
             # 复用共享上下文（若上游提供）
@@ -1,14 +1,16 @@
 import logging
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from retry import retry
 
 from .agent import Agent, RetryError, NoCodeError
 from ..prompts.tokens import calculate_token, token_limit
-from ..utils import read_yaml
-from ..parse import parse_code, parse_exp, exist_line, unique_matching, search_valid_line
+from ..utils import load_prompts
+from ..parse import parse_code, parse_exp, exist_line, unique_matching, search_valid_line, build_line_index
 
 
+_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/locator.yaml")
+
 COMMENT_BY_LANG = {
     "java": "//",
     "c": "//",
@@ -37,60 +39,67 @@ class LocateAgent(Agent):
     """Line-level localization with (optional) code slice context."""
 
     def parse_response(self, response: str, raw_code: str, comment_label: str = "//"):
-        resp_code = "\n".join([p.strip() for p in parse_code(response) if p.strip()])
+        parsed = parse_code(response)
+        resp_code = "\n".join([p.strip() for p in parsed if p.strip()])
         if "===" in resp_code:
             resp_code = resp_code[:resp_code.find("===")].strip()
 
         resp_lines, raw_code_lines = resp_code.splitlines(), raw_code.splitlines()
-        raw_lines_w_marks = [l for l in raw_code_lines]
+        # 每个原始行对应一组输出行，标注时只追加/插入片段，最后统一拼接
+        raw_lines_w_marks = [[l] for l in raw_code_lines]
+        raw_index = build_line_index(raw_code_lines)
 
         mark_indces = {i: (-1, "") for i, l in enumerate(resp_lines) if "missing" in l or "buggy" in l}
         for i, l in enumerate(resp_lines):
-            if i not in mark_indces and i - 1 in mark_indces and not exist_line(l, raw_code_lines):
+            if i not in mark_indces and i - 1 in mark_indces and not exist_line(l, raw_code_lines, index=raw_index):
                 mark_indces[i] = (-2, "")
 
         if len(mark_indces) == 0:
-            raise RetryError("No mark in the response!")
+            err = RetryError("No mark in the response!")
+            err.parsed = parsed  # 交给 run 复用，避免重复解析
+            raise err
 
         for resp_idx in sorted(list(mark_indces.keys())):
             if mark_indces[resp_idx][0] == -2 and resp_idx - 1 in mark_indces and mark_indces[resp_idx - 1][0] >= 0:
                 mark_indces[resp_idx] = mark_indces[resp_idx - 1]
                 (unique_idx, mode) = mark_indces[resp_idx - 1]
                 if mode == "pre":
-                    raw_lines_w_marks[unique_idx] += f"\n/* missing code:[{resp_lines[resp_idx].rstrip()}] */"
+                    raw_lines_w_marks[unique_idx].append(f"/* missing code:[{resp_lines[resp_idx].rstrip()}] */")
                 else:
-                    this_lines = raw_lines_w_marks[unique_idx].split("\n")
-                    added, ori = "\n".join(this_lines[:-1]), this_lines[-1]
-                    raw_lines_w_marks[unique_idx] = added + f"\n/* missing code:[{resp_lines[resp_idx]}] */\n" + ori
+                    # 插在原始行（最后一个片段）之前
+                    this_lines = raw_lines_w_marks[unique_idx]
+                    this_lines.insert(len(this_lines) - 1, f"/* missing code:[{resp_lines[resp_idx]}] */")
                 continue
 
             parts = resp_lines[resp_idx].split(comment_label, 1)
             code = parts[0].rstrip()
             comment = parts[1].strip() if len(parts) > 1 else "buggy line"
 
-            unique_idx = unique_matching(resp_lines, raw_code_lines, resp_idx)
+            unique_idx = unique_matching(resp_lines, raw_code_lines, resp_idx, index=raw_index)
             if unique_idx >= 0:
-                raw_lines_w_marks[unique_idx] += f" {comment_label} " + comment
+                raw_lines_w_marks[unique_idx][-1] += f" {comment_label} " + comment
                 mark_indces[resp_idx] = (unique_idx, "pre")
                 continue
             elif unique_idx == -2 and (len(code) or "missing" in resp_lines[resp_idx]) > 0:
-                pre_valid = search_valid_line(resp_lines, resp_idx, "pre", existing=raw_code_lines)
+                pre_valid = search_valid_line(resp_lines, resp_idx, "pre", existing=raw_code_lines, index=raw_index)
                 if pre_valid is not None:
-                    unique_idx = unique_matching(resp_lines, raw_code_lines, pre_valid[0], existing=True)
+                    unique_idx = unique_matching(resp_lines, raw_code_lines, pre_valid[0], existing=True, index=raw_index)
                     if unique_idx >= 0:
-                        raw_lines_w_marks[unique_idx] += (f"\n/* missing code:[{code}] // {comment} */")
+                        raw_lines_w_marks[unique_idx].append(f"/* missing code:[{code}] // {comment} */")
                         mark_indces[resp_idx] = (unique_idx, "pre")
                         continue
-                post_valid = search_valid_line(resp_lines, resp_idx, "post", existing=raw_code_lines)
+                post_valid = search_valid_line(resp_lines, resp_idx, "post", existing=raw_code_lines, index=raw_index)
                 if post_valid is not None:
-                    unique_idx = unique_matching(resp_lines, raw_code_lines, post_valid[0], existing=True)
+                    unique_idx = unique_matching(resp_lines, raw_code_lines, post_valid[0], existing=True, index=raw_index)
                     if unique_idx >= 0:
-                        raw_lines_w_marks[unique_idx] = (f"/* missing code:[{code}] // {comment} */\n") + raw_lines_w_marks[unique_idx]
+                        raw_lines_w_marks[unique_idx].insert(0, f"/* missing code:[{code}] // {comment} */")
                         mark_indces[resp_idx] = (unique_idx, "post")
 
         success = sum([i[0] >= 0 for i in mark_indces.values()])
         if success == 0:
-            raise RetryError(f"Cannot mark any line with {len(mark_indces)} marks")
+            err = RetryError(f"Cannot mark any line with {len(mark_indces)} marks")
+            err.parsed = parsed
+            raise err
 
         if success < len(mark_indces):
             logging.warning("Some labeled lines seem not from the original code")
@@ -98,7 +107,7 @@ class LocateAgent(Agent):
                 if not mark_indces[mark_idx]:
                     resp_lines[mark_idx] += f"  {comment_label} Cannot Mark!"
 
-        return {"aim": "\n".join(raw_lines_w_marks), "exp": parse_exp(response), "ori": response}
+        return {"aim": "\n".join(l for parts in raw_lines_w_marks for l in parts), "exp": parse_exp(response), "ori": response}
 
     def _generate_core_msg(self, info: Dict[str, Any], pre_agent_resp: Dict[str, Any]):
         if "slicer" in pre_agent_resp:
@@ -110,8 +119,10 @@ class LocateAgent(Agent):
         self._shared_msg(info, pre_agent_resp)
         logging.info(f"Current core message tokens: {calculate_token(self.core_msg)}")
 
-    def fast_parse(self, response: str):
-        resp_code = "\n".join([p.strip() for p in parse_code(response) if p.strip()])
+    def fast_parse(self, response: str, parsed: Optional[List[str]] = None):
+        if parsed is None:
+            parsed = parse_code(response)
+        resp_code = "\n".join([p.strip() for p in parsed if p.strip()])
         if "===" in resp_code:
             resp_code = resp_code[:resp_code.find("===")].strip()
         return {"aim": resp_code, "exp": parse_exp(response), "ori": response}
@@ -125,42 +136,51 @@ class LocateAgent(Agent):
         level: Optional[int] = None,
         signals: Optional[Dict[str, Any]] = None,
         max_retries: int = 5,
+        samples: int = 1,
         **kwargs
     ):
         logging.info("## Running LocateAgent...")
         if pre_agent_resp is None:
             pre_agent_resp = {}
 
-        prompts = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/locator.yaml"))
+        prompts = load_prompts(_PROMPT_PATH)
         if self.core_msg is None:
             self._generate_core_msg(info, pre_agent_resp)
 
         raw_code = pre_agent_resp.get("slicer", info["buggy_code"])
         comment_label = _comment_label_from(info)
 
+        msg = [
+            {"role": "system", "content": prompts["sys"]},
+            {"role": "user",   "content": self.core_msg + "\n" + prompts["end"]}
+        ]
         attempt = 0
-        bk_resp = None
+        bk_resp, bk_parsed = None, None
         while attempt < max_retries:
-            try:
-                response = self.send_message([
-                    {"role": "system", "content": prompts["sys"]},
-                    {"role": "user",   "content": self.core_msg + "\n" + prompts["end"]}
-                ])
-                return self.parse_response(response, raw_code, comment_label=comment_label)
-
-            except NoCodeError:
-                attempt += 1
-                logging.warning("No code, try again")
-            except RetryError:
-                attempt += 1
-                mark = sum([("// buggy line" in l or "// missing" in l) for l in parse_code(response)])
-                if mark > 0:
-                    bk_resp = response
-                else:
-                    logging.warning("Cannot mark any line, try again")
+            # samples > 1 draws several candidates from one request; each failed candidate counts as an attempt
+            responses = self.send_batch([msg] * samples) if samples > 1 else [self.send_message(msg)]
+            for response in responses:
+                if attempt >= max_retries:
+                    break
+                try:
+                    return self.parse_response(response, raw_code, comment_label=comment_label)
+
+                except NoCodeError:
+                    attempt += 1
+                    logging.warning("No code, try again")
+                except RetryError as e:
+                    attempt += 1
+                    parsed = getattr(e, "parsed", None)
+                    if parsed is None:
+                        parsed = parse_code(response)
+                    mark = sum([("// buggy line" in l or "// missing" in l) for l in parsed])
+                    if mark > 0:
+                        bk_resp, bk_parsed = response, parsed
+                    else:
+                        logging.warning("Cannot mark any line, try again")
 
         if bk_resp is not None:
-            return self.fast_parse(bk_resp)
+            return self.fast_parse(bk_resp, bk_parsed)
         else:
             raise ValueError("No available localization results!")
 
@@ -1,13 +1,24 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import Callable, Dict, List, Optional, Any
+from typing import Callable, Dict, Iterator, List, Optional, Any
+import os
+import re
+import copy
+import asyncio
+import json
+import sqlite3
+import functools
+import itertools
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from retry import retry
 
+import httpx
 import openai
 import google.generativeai as genai
 
-from ..utils import read_json
+from ..utils import read_json, pack_json, content_hash
 from ..prompts.tokens import calculate_token, token_limit
 
 
@@ -22,14 +33,148 @@ class RetryError(Exception):
         self.message = message
 
 
+class RateLimitedError(RetryError):
+    """RetryError raised when the provider rate-limited the request, so drivers can back off and retry."""
+
+
+def _retry_error(e: Exception) -> RetryError:
+    """Wrap a provider/client exception for the retry decorators, keeping rate limits recognisable."""
+    if isinstance(e, (openai.RateLimitError, RateLimitedError)):
+        return RateLimitedError(str(e))
+    return RetryError(str(e))
+
+
+DEFAULT_CACHE_PATH = "../res/cache/llm_cache.sqlite"
+
+
+class ResponseCache:
+    """
+    Persistent (model, messages, decoding) -> text cache backed by sqlite.
+    Shared by every agent pointing at the same file; safe across threads.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            parent = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(parent, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        return self._conn
+
+    @staticmethod
+    def key(model_name: str, msg: List[Dict[str, Any]], decoding: Dict[str, Any]) -> str:
+        serial = json.dumps([model_name, msg, decoding], sort_keys=True, default=str)
+        return content_hash(serial)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connect().execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, text: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO responses (key, text) VALUES (?, ?)", (key, text))
+            conn.commit()
+
+
+_CACHES: Dict[str, ResponseCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def _get_cache(path: Optional[str]) -> Optional[ResponseCache]:
+    if not path:
+        return None
+    path = os.path.abspath(path)
+    with _CACHES_LOCK:
+        if path not in _CACHES:
+            _CACHES[path] = ResponseCache(path)
+        return _CACHES[path]
+
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    _HAS_H2 = True
+except Exception:
+    _HAS_H2 = False
+
+# provider clients shared by all agents, one per (provider, endpoint, key); every OpenAI-style
+# client sits on the same HTTP client, so all endpoints draw from one bounded connection pool
+_CLIENTS: Dict[tuple, Any] = {}
+_CLIENTS_LOCK = threading.Lock()
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+
+def _shared_http() -> httpx.Client:
+    """The process-wide HTTP client; HTTP/2 (multiplexed requests per connection) when h2 is installed. Call under _CLIENTS_LOCK."""
+    key = ("http",)
+    if key not in _CLIENTS:
+        _CLIENTS[key] = httpx.Client(http2=_HAS_H2, limits=_HTTP_LIMITS, timeout=openai.DEFAULT_TIMEOUT, follow_redirects=True)
+    return _CLIENTS[key]
+
+
+def _shared_openai(base_url: Optional[str] = None, api_key: Optional[str] = None) -> openai.OpenAI:
+    key = ("openai", base_url, api_key)
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            kwargs: Dict[str, Any] = {"http_client": _shared_http()}
+            if base_url:
+                kwargs["base_url"] = base_url
+            if api_key:
+                kwargs["api_key"] = api_key
+            _CLIENTS[key] = openai.OpenAI(**kwargs)
+        return _CLIENTS[key]
+
+
+def _shared_gemini(model_name: str, api_key: str):
+    key = ("gemini", model_name, api_key)
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            genai.configure(api_key=api_key)
+            _CLIENTS[key] = genai.GenerativeModel(
+                model_name,
+                safety_settings=[
+                    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+                    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+                    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+                    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+                ],
+            )
+        return _CLIENTS[key]
+
+
+# worker threads behind the awaitable agent calls; also caps concurrent blocking requests.
+# Not the loop's default executor, so asyncio.run() returns without waiting on abandoned calls.
+_ASYNC_POOL = ThreadPoolExecutor(max_workers=32, thread_name_prefix="agent")
+
+
+# marker line opening each answer in a packed multi-task reply (see Agent.send_tasks)
+_TASK_RE = re.compile(r"^===TASK (\d+)===[ \t]*$", re.MULTILINE)
+# output cap for one packed request (within every supported model's completion limit);
+# each task gets the agent's own max_tokens within it
+PACKED_MAX_TOKENS = 4096
+
+
 class Agent(ABC):
     """
     Base class for all agents.
     Changes vs. original:
       - set_client -> _set_client, remove hardcoded proxy; read base_url/api_key from config if provided
+      - provider clients (and their keep-alive connection pools) are shared across agents
       - __shared_msg -> _shared_msg (protected, extensible)
       - add decoding params & score_hooks to support confidence/alignment scoring
       - send_message supports tools; applies hooks after getting text
+      - deterministic (temperature=0) text replies are cached on disk across runs (not truncated ones; bypassed on retries)
+      - stream_hooks receive reply deltas as they arrive (OpenAI-style clients stream when any are registered)
+      - send_message_stream yields reply deltas to callers that can start parsing early
+      - send_batch samples several replies for one prompt in a single request (n=), else fans out on threads
+      - send_tasks packs independent task bodies under one system prompt into a single request
+      - arun / arun_many / asend_message: awaitable variants for drivers that overlap several bugs
     """
 
     def __init__(
@@ -41,10 +186,18 @@ class Agent(ABC):
         temperature: float = 0.2,
         top_p: float = 0.95,
         max_tokens: int = 512,
+        cache_path: Optional[str] = DEFAULT_CACHE_PATH,
     ) -> None:
         self.model_name = model_name
         self.hash_id = hash_id
         self.client = self._set_client(config_path)
+        # persistent response cache; cache_path=None disables it
+        self.cache = _get_cache(cache_path)
+        # cache keys this agent has already answered: asking again means the caller rejected that
+        # reply (a retry), so the cached text is bypassed and overwritten with a fresh one
+        self._cache_served: set = set()
+        # finish_reason of the latest reply ("stop" for cache hits; None when unknown)
+        self.last_finish: Optional[str] = None
         self.core_msg: Optional[str] = None
 
         # decoding params (used for OpenAI-style clients)
@@ -52,6 +205,8 @@ class Agent(ABC):
 
         # optional score hooks: List[Callable[[Agent, str], None]]
         self.score_hooks: List[Callable[["Agent", str], None]] = []
+        # optional stream hooks, called with each text delta before the reply completes
+        self.stream_hooks: List[Callable[["Agent", str], None]] = []
 
     def __str__(self) -> str:
         return self.__class__.__name__
@@ -61,7 +216,7 @@ class Agent(ABC):
     # ---------- client & messaging ----------
 
     def _set_client(self, config_path: str):
-        """Create a provider client from config. No hardcoded proxies."""
+        """Get the shared provider client for this model from config. No hardcoded proxies."""
         config = read_json(config_path)
 
         # Prefer explicit keys; fallbacks keep compatibility
@@ -69,38 +224,47 @@ class Agent(ABC):
         openai_base = config.get("OpenAI_BASE")  # optional
 
         if self.model_name.startswith(("gpt", "claude", "o")):
-            kwargs = {}
-            if openai_base:
-                kwargs["base_url"] = openai_base
-            if openai_key:
-                kwargs["api_key"] = openai_key
-            return openai.OpenAI(**kwargs)
+            return _shared_openai(base_url=openai_base, api_key=openai_key)
 
         if self.model_name.startswith("deepseek"):
-            return openai.OpenAI(base_url="https://api.deepseek.com/v1", api_key=config["DeepSeek"])
+            return _shared_openai(base_url="https://api.deepseek.com/v1", api_key=config["DeepSeek"])
 
         if self.model_name.startswith("Phind"):
-            return openai.OpenAI(base_url="https://api.deepinfra.com/v1/openai", api_key=config["DeepInfra"])
+            return _shared_openai(base_url="https://api.deepinfra.com/v1/openai", api_key=config["DeepInfra"])
 
         if self.model_name.startswith("gemini"):
-            genai.configure(api_key=config["Gemini"])
-            return genai.GenerativeModel(
-                self.model_name,
-                safety_settings=[
-                    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-                ],
-            )
+            return _shared_gemini(self.model_name, config["Gemini"])
 
         # default fallback to OpenAI SDK with env var credentials
-        return openai.OpenAI()
+        return _shared_openai()
 
     def _handle_openai_response(self, response):
         finish = response.choices[0].finish_reason
         text = response.choices[0].message.content or ""
+        return self._handle_openai_finish(finish, text, response)
+
+    def _iter_openai_stream(self, stream, finish: List[str]) -> Iterator[str]:
+        """Yield text deltas of a streamed completion, feeding stream_hooks; finish_reason is appended to finish."""
+        for event in stream:
+            if not event.choices:
+                continue
+            choice = event.choices[0]
+            delta = (choice.delta.content or "") if choice.delta else ""
+            if delta:
+                self._apply_stream_hooks(delta)
+                yield delta
+            if choice.finish_reason:
+                finish.append(choice.finish_reason)
+
+    def _handle_openai_stream(self, stream):
+        """Consume a streamed completion, feeding deltas to stream_hooks; returns like _handle_openai_response."""
+        finish: List[str] = []
+        text = "".join(self._iter_openai_stream(stream, finish))
+        return self._handle_openai_finish(finish[-1] if finish else None, text, None)
+
+    def _handle_openai_finish(self, finish, text: str, response):
         logging.debug(f"[LLM finish_reason] {finish}")
+        self.last_finish = finish
         if finish in {"stop", "length"}:
             if finish == "length":
                 logging.warning(f"Response truncated with {len(text)} characters.")
@@ -133,12 +297,19 @@ class Agent(ABC):
             self.core_msg = (self.core_msg or "") + "\nThe code fails on this test:\n" + info["failing_test_cases"]
 
         # summarizer/context/helper (respect token budget)
+        # calculate_token is already a len//4 estimate, so it doubles as the cheap pre-filter;
+        # look the budget up once instead of per check
+        limit = token_limit[self.model_name]["overall"]
         if "summarizer" in pre_agent_resp:
-            if calculate_token((self.core_msg or "") + pre_agent_resp["summarizer"]) <= token_limit[self.model_name]["overall"]:
-                self.core_msg = "Related code summary:\n" + pre_agent_resp["summarizer"] + "\n" + (self.core_msg or "")
+            # summarizer 的结构化结果以 dict 形式传递，只在拼进 prompt 时确定性序列化一次
+            summary = pre_agent_resp["summarizer"]
+            if not isinstance(summary, str):
+                summary = pack_json(summary)
+            if calculate_token(self.core_msg or "", summary) <= limit:
+                self.core_msg = "Related code summary:\n" + summary + "\n" + (self.core_msg or "")
 
         if "helper" in pre_agent_resp:
-            if calculate_token((self.core_msg or "") + pre_agent_resp["helper"]) <= token_limit[self.model_name]["overall"]:
+            if calculate_token(self.core_msg or "", pre_agent_resp["helper"]) <= limit:
                 self.core_msg = "Reference debugging guide:\n" + pre_agent_resp["helper"] + "\n" + (self.core_msg or "")
 
     # ---------- hooks ----------
@@ -147,35 +318,236 @@ class Agent(ABC):
         """Register a post-generation scoring hook (e.g., compute D_aln / C)."""
         self.score_hooks.append(fn)
 
+    def register_stream_hook(self, fn: Callable[["Agent", str], None]) -> None:
+        """Register a hook fed with each reply delta while the completion streams in."""
+        self.stream_hooks.append(fn)
+
+    def _apply_score_hooks(self, text: str) -> None:
+        for fn in self.score_hooks:
+            try:
+                fn(self, text)
+            except Exception as hook_err:
+                logging.debug(f"[score_hook skipped] {hook_err}")
+
+    def _apply_stream_hooks(self, delta: str) -> None:
+        for fn in self.stream_hooks:
+            try:
+                fn(self, delta)
+            except Exception as hook_err:
+                logging.debug(f"[stream_hook skipped] {hook_err}")
+
     # ---------- chat ----------
 
+    def _cache_lookup(self, msg: List[Dict[str, str]]):
+        """(cache_key, cached text or None) for a deterministic text request; key is None when uncacheable."""
+        self.last_finish = None
+        if self.cache is None or self.decoding.get("temperature") != 0:
+            return None, None
+        cache_key = self.cache.key(self.model_name, msg, self.decoding)
+        if cache_key in self._cache_served:
+            logging.debug("[LLM cache] bypassed on retry")
+            return cache_key, None
+        self._cache_served.add(cache_key)
+        out = self.cache.get(cache_key)
+        if out is not None:
+            logging.debug("[LLM cache] hit")
+            self.last_finish = "stop"
+        return cache_key, out
+
+    def _cache_store(self, cache_key: Optional[str], out: str) -> None:
+        # truncated replies are not reusable: the retry that follows would get the same cut-off text
+        if cache_key is not None and self.last_finish != "length":
+            self.cache.set(cache_key, out)
+
     @retry((RetryError, Exception), tries=6, delay=30, backoff=2)
     def send_message(self, msg: List[Dict[str, str]], tools: Optional[List[Dict[str, Any]]] = None, handling: bool = True):
         try:
+            # only deterministic text replies are reusable; sampled ones must stay fresh for retries
+            cache_key = None
+            self.last_finish = None
+            if handling and not tools:
+                cache_key, out = self._cache_lookup(msg)
+                if out is not None:
+                    self._apply_stream_hooks(out)
+                    self._apply_score_hooks(out)
+                    return out
+
             if not self.model_name.startswith("gemini"):
                 kwargs = dict(model=self.model_name, messages=msg)
                 kwargs.update(self.decoding)
                 if tools:
                     kwargs["tools"] = tools
-                resp = self.client.chat.completions.create(**kwargs)
-                out = self._handle_openai_response(resp) if handling else resp
+                if self.stream_hooks and handling and not tools:
+                    # stream only when someone consumes deltas; tool calls stay on the plain path
+                    out = self._handle_openai_stream(self.client.chat.completions.create(stream=True, **kwargs))
+                else:
+                    resp = self.client.chat.completions.create(**kwargs)
+                    out = self._handle_openai_response(resp) if handling else resp
             else:
                 resp = self.client.generate_content(self._dict_prompt_to_text(msg))
                 out = self._handle_gemini_response(resp) if handling else resp
 
             # apply hooks on text output
             if handling and isinstance(out, str):
-                for fn in self.score_hooks:
-                    try:
-                        fn(self, out)
-                    except Exception as hook_err:
-                        logging.debug(f"[score_hook skipped] {hook_err}")
+                self._cache_store(cache_key, out)
+                self._apply_score_hooks(out)
 
             return out
 
         except Exception as e:
             logging.warning(f"[Retry Triggered] Exception in send_message: {e}")
-            raise RetryError(str(e))
+            raise _retry_error(e)
+
+    def send_message_stream(self, msg: List[Dict[str, str]]) -> Iterator[str]:
+        """
+        Yield the text reply in pieces as they arrive, so callers can start work before it completes.
+        Cache hits and Gemini yield the whole reply at once. Hooks and the response cache behave as in
+        send_message. Opening the stream (up to its first event) is retried like send_message; a failure
+        after deltas have been yielded surfaces as RetryError for the caller's retry.
+        """
+        if self.model_name.startswith("gemini"):
+            yield self.send_message(msg)
+            return
+
+        cache_key, out = self._cache_lookup(msg)
+        if out is not None:
+            self._apply_stream_hooks(out)
+            self._apply_score_hooks(out)
+            yield out
+            return
+
+        kwargs = dict(model=self.model_name, messages=msg)
+        kwargs.update(self.decoding)
+        chunks: List[str] = []
+        finish: List[str] = []
+        stream = self._open_stream(kwargs)
+        try:
+            for delta in self._iter_openai_stream(stream, finish):
+                chunks.append(delta)
+                yield delta
+        except RetryError:
+            raise
+        except Exception as e:
+            logging.warning(f"[Retry Triggered] Exception in send_message_stream: {e}")
+            raise _retry_error(e)
+
+        out = self._handle_openai_finish(finish[-1] if finish else None, "".join(chunks), None)
+        if not isinstance(out, str):
+            raise RetryError("No text reply from the stream")
+        self._cache_store(cache_key, out)
+        self._apply_score_hooks(out)
+
+    @retry((RetryError, Exception), tries=6, delay=30, backoff=2)
+    def _open_stream(self, kwargs: Dict[str, Any]) -> Iterator[Any]:
+        """
+        Start a streamed completion and wait for its first event, with send_message's retry policy:
+        rate limits and connection errors show up here, before anything has been handed to the caller.
+        """
+        try:
+            stream = iter(self.client.chat.completions.create(stream=True, **kwargs))
+            first = next(stream, None)
+        except Exception as e:
+            logging.warning(f"[Retry Triggered] Exception opening stream: {e}")
+            raise _retry_error(e)
+        return stream if first is None else itertools.chain([first], stream)
+
+    @retry((RetryError, Exception), tries=6, delay=30, backoff=2)
+    def _send_n(self, msg: List[Dict[str, str]], n: int) -> List[Optional[str]]:
+        try:
+            kwargs = dict(model=self.model_name, messages=msg, n=n)
+            kwargs.update(self.decoding)
+            resp = self.client.chat.completions.create(**kwargs)
+            outs = [self._handle_openai_finish(c.finish_reason, c.message.content or "", resp) for c in resp.choices]
+            for out in outs:
+                if isinstance(out, str):
+                    self._apply_score_hooks(out)
+            return outs
+        except Exception as e:
+            logging.warning(f"[Retry Triggered] Exception in send_batch: {e}")
+            raise _retry_error(e)
+
+    def send_batch(self, msgs: List[List[Dict[str, str]]]) -> List[Optional[str]]:
+        """
+        Send several text prompts and return their replies in order.
+        Identical prompts to an OpenAI-style client go out as one request with n=len(msgs),
+        so the shared prompt is processed once; anything else is sent concurrently via send_message.
+        """
+        if not msgs:
+            return []
+        if len(msgs) > 1 and not self.model_name.startswith("gemini") and all(m == msgs[0] for m in msgs):
+            return self._send_n(msgs[0], len(msgs))
+        with ThreadPoolExecutor(max_workers=len(msgs)) as ex:
+            return list(ex.map(self.send_message, msgs))
+
+    def max_packed_tasks(self) -> int:
+        """How many tasks one packed request can answer at the agent's per-task max_tokens."""
+        return max(1, PACKED_MAX_TOKENS // self.decoding["max_tokens"])
+
+    def send_tasks(self, system: str, bodies: List[str], end: str = "") -> Optional[List[Optional[str]]]:
+        """
+        Send several independent task bodies that share one system prompt as a single request.
+        The request may produce max_tokens per task. Returns one entry per body: its answer, or None
+        when that answer is missing from the reply or was cut off, so callers redo only those items.
+        Returns None when the packed prompt exceeds the model budget or there are more tasks than
+        max_packed_tasks(); callers then go per item.
+        """
+        if not bodies:
+            return []
+        if len(bodies) > self.max_packed_tasks():
+            return None
+        if calculate_token(system, end, *bodies) > token_limit[self.model_name]["overall"]:
+            return None
+        user = (
+            f"You will receive {len(bodies)} independent tasks. Answer every task separately, "
+            "starting each answer with its marker line exactly as given (===TASK i===).\n\n"
+            + "\n\n".join(f"===TASK {i}===\n{body}" for i, body in enumerate(bodies, 1))
+            + "\n\n" + end
+        )
+        saved = self.decoding
+        self.decoding = dict(saved, max_tokens=saved["max_tokens"] * len(bodies))
+        try:
+            reply = self.send_message([
+                {"role": "system", "content": system},
+                {"role": "user",   "content": user}
+            ]) or ""
+        finally:
+            self.decoding = saved
+
+        answers: List[Optional[str]] = [None] * len(bodies)
+        marks = list(_TASK_RE.finditer(reply))
+        ends = [m.start() for m in marks[1:]] + [len(reply)]
+        for m, e in zip(marks, ends):
+            i = int(m.group(1)) - 1
+            if 0 <= i < len(bodies) and answers[i] is None:
+                answers[i] = reply[m.end():e].strip()
+        if marks and self.last_finish == "length":
+            # the answer being written when the reply hit max_tokens is incomplete
+            i = int(marks[-1].group(1)) - 1
+            if 0 <= i < len(bodies):
+                answers[i] = None
+        missing = sum(a is None for a in answers)
+        if missing:
+            logging.warning(f"Packed reply lacks {missing} of {len(bodies)} task answers")
+        return answers
+
+    # ---------- async ----------
+
+    async def asend_message(self, msg: List[Dict[str, str]], tools: Optional[List[Dict[str, Any]]] = None, handling: bool = True):
+        """Awaitable send_message; the blocking call runs on a worker thread over the shared client pool."""
+        return await asyncio.get_running_loop().run_in_executor(
+            _ASYNC_POOL, functools.partial(self.send_message, msg, tools, handling))
+
+    async def arun(self, *args, **kwargs):
+        """
+        Awaitable run. Each call works on a shallow copy of the agent, so concurrent calls
+        do not overwrite each other's core_msg; client, cache and hooks stay shared.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            _ASYNC_POOL, functools.partial(copy.copy(self).run, *args, **kwargs))
+
+    async def arun_many(self, infos: List[Dict], *args) -> List[Any]:
+        """Run this agent on several independent infos concurrently; results keep input order."""
+        return await asyncio.gather(*(self.arun(info, *args) for info in infos))
 
     # ---------- subclass API ----------
 
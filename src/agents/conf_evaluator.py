@@ -15,6 +15,15 @@ def _clip01(x: float) -> float:
         return 0.0
 
 
+def _clip01_fast(x: float) -> float:
+    # no coercion/try for values that are already numeric; NaN maps to 1.0 like _clip01
+    return 0.0 if x < 0.0 else (1.0 if not x <= 1.0 else float(x))
+
+
+def _to01(x: Any) -> float:
+    return _clip01_fast(x) if isinstance(x, (int, float)) else _clip01(x)
+
+
 def _size_score(lines_changed: int, alpha: float = 0.08) -> float:
     """Prefer smaller patches; monotone decreasing."""
     lines = max(0, int(lines_changed or 0))
@@ -39,6 +48,7 @@ class ConfEvaluator(Agent):
         attempt: int = 0,
         budget_K: int | None = None,
         weights: Dict[str, float] | None = None,
+        explain: bool = True,
         **kwargs,
     ):
         """
@@ -50,18 +60,18 @@ class ConfEvaluator(Agent):
           "history_ratio": float in [0,1],        # optional (client success rate)
           ...
         }
+        explain=False skips formatting the "exp" string (left empty) for callers that only need C/decision.
         """
         w = {"align": 0.50, "static": 0.15, "compile": 0.20, "size": 0.10, "hist": 0.05}
         if weights:
             w.update(weights)
 
-        d_aln = _clip01(signals.get("D_aln", 0.0))
-        static_ok = signals.get("static_ok", 0.0)
-        static_score = _clip01(1.0 if isinstance(static_ok, bool) and static_ok else static_ok)
-        compile_ok = signals.get("compile_ok", 0.0)
-        compile_score = _clip01(1.0 if isinstance(compile_ok, bool) and compile_ok else compile_ok)
+        # bools are ints, so True/False take the fast path as 1.0/0.0
+        d_aln = _to01(signals.get("D_aln", 0.0))
+        static_score = _to01(signals.get("static_ok", 0.0))
+        compile_score = _to01(signals.get("compile_ok", 0.0))
         size = _size_score(signals.get("lines_changed", 0))
-        hist = _clip01(signals.get("history_ratio", 0.0))
+        hist = _to01(signals.get("history_ratio", 0.0))
 
         C = (
             w["align"] * d_aln
@@ -70,7 +80,7 @@ class ConfEvaluator(Agent):
             + w["size"] * size
             + w["hist"] * hist
         )
-        C = _clip01(C)
+        C = _clip01_fast(C)
 
         # 阈值读取（支持 str/int key）
         theta = None
@@ -93,15 +103,18 @@ class ConfEvaluator(Agent):
             else:
                 decision = "escalate"
 
-        explain = (
-            f"C = {w['align']:.2f}*D_aln({d_aln:.3f}) + {w['static']:.2f}*static({static_score:.3f}) + "
-            f"{w['compile']:.2f}*compile({compile_score:.3f}) + {w['size']:.2f}*size({size:.3f}) + "
-            f"{w['hist']:.2f}*history({hist:.3f}) = {C:.3f} vs θ_{level}={theta:.3f} -> {decision}"
-        )
+        exp = ""
+        if explain or logging.getLogger().isEnabledFor(logging.DEBUG):
+            exp = (
+                f"C = {w['align']:.2f}*D_aln({d_aln:.3f}) + {w['static']:.2f}*static({static_score:.3f}) + "
+                f"{w['compile']:.2f}*compile({compile_score:.3f}) + {w['size']:.2f}*size({size:.3f}) + "
+                f"{w['hist']:.2f}*history({hist:.3f}) = {C:.3f} vs θ_{level}={theta:.3f} -> {decision}"
+            )
+            logging.debug(f"[ConfEvaluator] {exp}")
 
         payload = {
             "aim": C,
-            "exp": explain,
+            "exp": exp if explain else "",
             "ori": "",
             "metrics": {
                 "C": C,
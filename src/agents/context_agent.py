@@ -3,34 +3,70 @@ import os
 import re
 import json
 import logging
+import threading
 from typing import Optional, Dict, Any
 from retry import retry
 
-from ..utils import read_yaml
+from ..utils import read_yaml, load_prompts
 from .agent import Agent, RetryError
 from ..prompts.tokens import calculate_token, token_limit
 
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROMPT_DIR = os.path.join(_BASE_DIR, "..", "prompts")
+_PROMPT_PATH = os.path.join(_PROMPT_DIR, "helper.yaml")
+
 try:
     from tavily import TavilyClient
     _HAS_TAVILY = True
 except Exception:
     _HAS_TAVILY = False
 
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    _HAS_ORJSON = False
+
+_JSON_FENCE = re.compile(r"```(?:json)?\s*([\s\S]*?)```", re.IGNORECASE)
+
+
+def _json_loads(s: str) -> Any:
+    return orjson.loads(s) if _HAS_ORJSON else json.loads(s)
+
+
+def _json_dumps(obj: Any) -> str:
+    # the tool payload may carry an ~8000-token search result; orjson serializes it in C
+    return orjson.dumps(obj).decode("utf-8") if _HAS_ORJSON else json.dumps(obj)
+
+
+# resolved Tavily client per env dir (None = not configured); the env yaml is read at most once
+_TAVILY_CLIENTS: Dict[str, Any] = {}
+_TAVILY_LOCK = threading.Lock()
+
+
+def _get_tavily(base_dir: str):
+    """Return the Tavily client configured by base_dir/tavily_env.yaml, or None."""
+    if not _HAS_TAVILY:
+        return None
+    with _TAVILY_LOCK:
+        if base_dir not in _TAVILY_CLIENTS:
+            client = None
+            env_path = os.path.join(base_dir, "tavily_env.yaml")
+            if os.path.exists(env_path):
+                api_key = (read_yaml(env_path) or {}).get("api_key")
+                if api_key:
+                    client = TavilyClient(api_key=api_key)
+            _TAVILY_CLIENTS[base_dir] = client
+        return _TAVILY_CLIENTS[base_dir]
+
 
 def _maybe_tavily_search(query: str, base_dir: str) -> Optional[str]:
     """
     Try to run Tavily search if env is configured; otherwise return None.
     """
-    if not _HAS_TAVILY:
-        return None
-    env_path = os.path.join(base_dir, "tavily_env.yaml")
-    if not os.path.exists(env_path):
-        return None
-    tavily_env = read_yaml(env_path)
-    api_key = tavily_env.get("api_key")
-    if not api_key:
+    client = _get_tavily(base_dir)
+    if client is None:
         return None
-    client = TavilyClient(api_key=api_key)
     try:
         return client.get_search_context(query, search_depth="advanced", max_tokens=8000)
     except Exception as e:
@@ -39,7 +75,7 @@ def _maybe_tavily_search(query: str, base_dir: str) -> Optional[str]:
 
 
 def _extract_json_block(text: str) -> Optional[str]:
-    m = re.search(r"```(?:json)?\s*([\s\S]*?)```", text, re.IGNORECASE)
+    m = _JSON_FENCE.search(text)
     if m:
         return m.group(1).strip()
     # fallback to braces
@@ -70,7 +106,7 @@ class ContextAgent(Agent):
 
         if js:
             try:
-                obj = json.loads(js)
+                obj = _json_loads(js)
                 if isinstance(obj, dict):
                     payload["notes"] = obj.get("notes", "")
                     payload["hints"] = obj.get("hints", []) or obj.get("bullets", [])
@@ -111,7 +147,7 @@ class ContextAgent(Agent):
 
         self._shared_msg(info, pre_agent_resp)
 
-        if "coverage_report" in info and calculate_token(self.core_msg + info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
+        if "coverage_report" in info and calculate_token(self.core_msg, info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
             self.core_msg = "Code coverage for failed testcases:\n" + info["coverage_report"] + "\n" + self.core_msg
 
         logging.info(f"[ContextAgent] core tokens: {calculate_token(self.core_msg)}")
@@ -130,15 +166,14 @@ class ContextAgent(Agent):
         if pre_agent_resp is None:
             pre_agent_resp = {}
 
-        prompts = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/helper.yaml"))
+        prompts = load_prompts(_PROMPT_PATH)
 
         if self.core_msg is None:
             self._generate_core_msg(info, pre_agent_resp)
 
         # tools: Tavily (optional)
-        base_dir = os.path.dirname(os.path.abspath(__file__))
         tools = None
-        if use_web and _HAS_TAVILY and os.path.exists(os.path.join(base_dir, "tavily_env.yaml")):
+        if use_web and _get_tavily(_BASE_DIR) is not None:
             tools = [{
                 "type": "function",
                 "function": {
@@ -158,41 +193,41 @@ class ContextAgent(Agent):
                 }
             }]
 
+        base_msg = [
+            {"role": "system", "content": prompts["sys"]},
+            {"role": "user",   "content": self.core_msg + "\n" + prompts["end"]},
+        ]
+        final = None
         if tools:
             # tool-use path
             for _ in range(max_tries):
-                resp = self.send_message(
-                    msg=[
-                        {"role": "system", "content": prompts["sys"]},
-                        {"role": "user",   "content": self.core_msg + "\n" + prompts["end"]},
-                    ],
-                    tools=tools,
-                    handling=False
-                )
-                if getattr(resp.choices[0], "finish_reason", "") == "tool_calls":
-                    arguments = json.loads(resp.choices[0].message.tool_calls[0].function.arguments)
+                resp = self.send_message(msg=base_msg, tools=tools, handling=False)
+                choice = resp.choices[0]
+                if getattr(choice, "finish_reason", "") == "tool_calls":
+                    arguments = _json_loads(choice.message.tool_calls[0].function.arguments)
                     query = (arguments or {}).get("query", "")
                     logging.info("[ContextAgent] Web query: %s", query)
-                    context = _maybe_tavily_search(query, base_dir) or ""
-                    final = self.send_message([
-                        {"role": "system", "content": prompts["sys"]},
-                        {"role": "user",   "content": self.core_msg + "\n" + prompts["end"]},
-                        resp.choices[0].message,
+                    context = _maybe_tavily_search(query, _BASE_DIR) or ""
+                    final = self.send_message(base_msg + [
+                        choice.message,
                         {"role": "tool",
-                         "content": json.dumps({"query": query, "tavily_search_result": context}),
-                         "tool_call_id": resp.choices[0].message.tool_calls[0].id}
+                         "content": _json_dumps({"query": query, "tavily_search_result": context}),
+                         "tool_call_id": choice.message.tool_calls[0].id}
                     ])
                     info_meta = {
                         "project": info.get("project_meta", {}),
                         "have_web": bool(context),
                     }
                     return self.parse_response(final, info_meta=info_meta)
+                if getattr(choice, "finish_reason", "") in {"stop", "length"} and choice.message.content:
+                    # answered without searching: keep this reply instead of asking the same prompt again
+                    final = choice.message.content
+                    self._apply_score_hooks(final)
+                    break
 
         # no-tool fallback (or Tavily unavailable)
-        final = self.send_message([
-            {"role": "system", "content": prompts["sys"]},
-            {"role": "user",   "content": self.core_msg + "\n" + prompts["end"]}
-        ])
+        if final is None:
+            final = self.send_message(base_msg)
         info_meta = {
             "project": info.get("project_meta", {}),
             "have_web": False,
@@ -4,12 +4,35 @@ import os
 import re
 import math
 import json
+import zlib
+import hashlib
 import logging
-from typing import Dict, List, Optional
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from retry import retry
 
 from .agent import Agent, RetryError
 
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except Exception:
+    _HAS_NUMPY = False
+
+try:
+    from codebleu import calc_code_bleu  # type: ignore
+    _HAS_CODEBLEU = True
+except Exception:
+    _HAS_CODEBLEU = False
+
+_TOK_RE = re.compile(r"[A-Za-z_]+")
+_WS_RE = re.compile(r"\s+")
+# diff '+' lines, allowing leading indentation (same as ln.strip().startswith("+"))
+_ADDED_RE = re.compile(r"^[^\S\r\n]*\+[^\r\n]*", re.MULTILINE)
+
 
 def _norm01(x: float) -> float:
     if x is None or math.isnan(x):
@@ -17,36 +40,113 @@ def _norm01(x: float) -> float:
     return max(0.0, min(1.0, float(x)))
 
 
-def _cosine(u: List[float], v: List[float]) -> float:
-    import numpy as np
-    a, b = np.array(u, dtype=float), np.array(v, dtype=float)
-    if a.size == 0 or b.size == 0:
-        return 0.0
-    denom = (np.linalg.norm(a) * np.linalg.norm(b))
-    if denom == 0:
+def _unit(vec: List[float]):
+    """L2-normalize to float32 once, so every later cosine is a bare dot product."""
+    if not _HAS_NUMPY:
+        n = math.sqrt(sum(x * x for x in vec))
+        return [x / n for x in vec] if n else list(vec)
+    a = np.asarray(vec, dtype=np.float32)
+    n = np.linalg.norm(a)
+    if n > 0:
+        a /= n
+    return a
+
+
+def _cosine(u, v) -> float:
+    # inputs are unit-norm (see _unit); zero or mismatched vectors score 0
+    if len(u) == 0 or len(v) == 0 or len(u) != len(v):
         return 0.0
-    return float(np.dot(a, b) / denom)
+    if not _HAS_NUMPY:
+        return float(sum(x * y for x, y in zip(u, v)))
+    return float(np.dot(u, v))
+
+
+def _bow_vec(text: str, dim: int = 1 << 16):
+    """
+    Very light hashed bag-of-words vector for fallback cosine, already L2-normalized.
+    Tokens hash into a fixed index space (dim must be a power of two), so any two texts are comparable.
+    """
+    toks = _TOK_RE.findall((text or "").lower())
+    v = np.zeros(dim, dtype=np.float32) if _HAS_NUMPY else [0.0] * dim
+    for tok in toks:
+        # crc32 rather than hash(): stable across processes, so fallback scores are reproducible
+        v[zlib.crc32(tok.encode("utf-8")) & (dim - 1)] += 1.0
+    return _unit(v)
 
 
-def _bow_vec(text: str) -> List[float]:
-    # very light bag-of-words vector for fallback cosine
-    from collections import Counter
-    toks = re.findall(r"[A-Za-z_]+", (text or "").lower())
-    cnt = Counter(toks)
-    keys = sorted(cnt.keys())
-    return [cnt[k] for k in keys]
+class _LRU:
+    """Small thread-safe process-level LRU; values must not be None."""
 
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Tuple, object]" = OrderedDict()
+        self._lock = threading.Lock()
 
-def _ngram_jaccard(a: str, b: str, n: int = 3) -> float:
-    def grams(s: str) -> set:
-        s = re.sub(r"\s+", " ", s.strip())
-        return set([s[i:i+n] for i in range(max(0, len(s)-n+1))])
-    A, B = grams(a or ""), grams(b or "")
-    if not A or not B:
+    def get(self, key: Tuple):
+        with self._lock:
+            val = self._data.get(key)
+            if val is not None:
+                self._data.move_to_end(key)
+            return val
+
+    def put(self, key: Tuple, val) -> None:
+        with self._lock:
+            self._data[key] = val
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def _sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+# embedding vectors keyed by (model, sha1(text)); shared across refine iterations
+_EMBED_CACHE = _LRU(1024)
+# LLM NLI labels keyed by (model, sha1(premise), sha1(hypothesis)); repeated pairs skip the call
+_NLI_CACHE = _LRU(1024)
+# reference-side n-grams of context code, which stays fixed across a bug's refine attempts
+_REF_GRAMS = _LRU(64)
+# hypothesis (texts) token sets for the NLI overlap fallback, keyed by sha1
+_HYP_TOKENS = _LRU(64)
+# shorter premise/hypothesis carry no signal worth a request; scored neutral
+_NLI_MIN_CHARS = 8
+
+
+def _ngram_ids(s: str, n: int):
+    """
+    Unique character n-grams of s as packed uint64 ids (21 bits per code point, so n <= 3).
+    Equal ids <=> equal substrings; the whole scan runs inside numpy.
+    """
+    cp = np.frombuffer(s.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if cp.size < n:
+        return cp[:0]
+    ids = cp[:cp.size - n + 1].copy()
+    for k in range(1, n):
+        ids <<= np.uint64(21)
+        ids |= cp[k:cp.size - n + 1 + k]
+    return np.unique(ids)
+
+
+def _ngram_set(s: str, n: int):
+    """Unique n-grams of whitespace-normalized s: packed numpy ids when possible, else a set of substrings."""
+    s = _WS_RE.sub(" ", (s or "").strip())
+    if _HAS_NUMPY and 0 < n <= 3:
+        return _ngram_ids(s, n)
+    return set([s[i:i+n] for i in range(max(0, len(s)-n+1))])
+
+
+def _jaccard(A, B) -> float:
+    if len(A) == 0 or len(B) == 0:
         return 0.0
-    inter = len(A & B)
-    union = len(A | B)
-    return inter / union if union else 0.0
+    if isinstance(A, set):
+        return len(A & B) / len(A | B)
+    inter = np.intersect1d(A, B, assume_unique=True).size
+    return inter / (A.size + B.size - inter)
+
+
+def _ngram_jaccard(a: str, b: str, n: int = 3) -> float:
+    return _jaccard(_ngram_set(a, n), _ngram_set(b, n))
 
 
 class DescAligner(Agent):
@@ -54,42 +154,70 @@ class DescAligner(Agent):
     Compute D_aln using three signals: NLI entailment, CodeBLEU (code-code), and cross-modal cosine.
     """
 
-    def _embed_text(self, text: str, model: Optional[str]) -> List[float]:
+    def _embed_texts(self, texts: List[str], model: Optional[str]) -> List[List[float]]:
+        """
+        Embed several texts with one embeddings request; cached vectors skip the API entirely.
+        Vectors come back L2-normalized for _cosine.
+        Falls back to bag-of-words for all texts so both sides of a cosine stay comparable.
+        """
+        texts = [t or "" for t in texts]
         try:
             # OpenAI embeddings path (preferred)
             if hasattr(self.client, "embeddings") and callable(getattr(self.client, "embeddings").create):
                 emb_model = model or "text-embedding-3-large"
-                vec = self.client.embeddings.create(model=emb_model, input=(text or ""))  # type: ignore
-                return vec.data[0].embedding  # type: ignore
+                keys = [(emb_model, _sha1(t)) for t in texts]
+                vecs = [_EMBED_CACHE.get(k) for k in keys]
+                miss = [i for i, v in enumerate(vecs) if v is None]
+                if miss:
+                    resp = self.client.embeddings.create(model=emb_model, input=[texts[i] for i in miss])  # type: ignore
+                    for i, d in zip(miss, resp.data):  # type: ignore
+                        vecs[i] = _unit(d.embedding)
+                        _EMBED_CACHE.put(keys[i], vecs[i])
+                return vecs
         except Exception as e:
             logging.debug(f"[DescAligner] embed fallback: {e}")
         # fallback to bag-of-words
-        return _bow_vec(text or "")
+        return [_bow_vec(t) for t in texts]
+
+    def _embed_text(self, text: str, model: Optional[str]) -> List[float]:
+        return self._embed_texts([text], model)[0]
 
     def _codebleu(self, g: str, g_ctx: str) -> float:
         # try real CodeBLEU if available
-        try:
-            from codebleu import calc_code_bleu  # type: ignore
-            # Guess language; users可在 info 里传 language 进一步覆盖
-            lang = "java"
-            refs = [g_ctx or ""]
-            hyp = g or ""
-            score_dict = calc_code_bleu.get_codebleu(refs, hyp, lang)
-            # codebleu库可能返回 dict 或 tuple
-            if isinstance(score_dict, dict):
-                return float(score_dict.get("codebleu", 0.0))
-            if isinstance(score_dict, (list, tuple)) and score_dict:
-                return float(score_dict[0])
-        except Exception as e:
-            logging.debug(f"[DescAligner] CodeBLEU fallback: {e}")
-        # fallback: n-gram jaccard
-        return _ngram_jaccard(g or "", g_ctx or "", n=3)
+        if _HAS_CODEBLEU:
+            try:
+                # Guess language; users可在 info 里传 language 进一步覆盖
+                lang = "java"
+                refs = [g_ctx or ""]
+                hyp = g or ""
+                score_dict = calc_code_bleu.get_codebleu(refs, hyp, lang)
+                # codebleu库可能返回 dict 或 tuple
+                if isinstance(score_dict, dict):
+                    return float(score_dict.get("codebleu", 0.0))
+                if isinstance(score_dict, (list, tuple)) and score_dict:
+                    return float(score_dict[0])
+            except Exception as e:
+                logging.debug(f"[DescAligner] CodeBLEU fallback: {e}")
+        # fallback: n-gram jaccard; the context side is reused across refine attempts
+        key = (3, _sha1(g_ctx or ""))
+        ref = _REF_GRAMS.get(key)
+        if ref is None:
+            ref = _ngram_set(g_ctx, 3)
+            _REF_GRAMS.put(key, ref)
+        return _jaccard(_ngram_set(g, 3), ref)
 
     def _nli_entail(self, premise: str, hypothesis: str) -> float:
         """
         Return entailment score in [0,1].
         Preferred: LLM classification; fallback: keyword overlap.
+        Trivially short inputs are neutral without a request; LLM labels are memoized per pair.
         """
+        if len((premise or "").strip()) < _NLI_MIN_CHARS or len((hypothesis or "").strip()) < _NLI_MIN_CHARS:
+            return 0.5
+        key = (self.model_name, _sha1(premise), _sha1(hypothesis))
+        cached = _NLI_CACHE.get(key)
+        if cached is not None:
+            return cached
         try:
             prompt = (
                 "You are a precise NLI classifier. "
@@ -103,27 +231,33 @@ class DescAligner(Agent):
             ])
             text = (resp or "").lower()
             if "entail" in text:
-                return 1.0
-            if "contradict" in text:
-                return 0.0
-            return 0.5
+                score = 1.0
+            elif "contradict" in text:
+                score = 0.0
+            else:
+                score = 0.5
+            _NLI_CACHE.put(key, score)
+            return score
         except Exception as e:
             logging.debug(f"[DescAligner] NLI fallback: {e}")
             # fallback: simple token overlap
-            p = set(re.findall(r"[A-Za-z_]+", (premise or "").lower()))
-            h = set(re.findall(r"[A-Za-z_]+", (hypothesis or "").lower()))
+            p = set(_TOK_RE.findall((premise or "").lower()))
+            h = _HYP_TOKENS.get(key[2])
+            if h is None:
+                h = frozenset(_TOK_RE.findall((hypothesis or "").lower()))
+                _HYP_TOKENS.put(key[2], h)
             return _norm01(len(p & h) / (len(h) + 1e-6))
 
     def _sigma(self, patch_text: str) -> str:
         """
         Diff-to-text verbalization: extract '+' lines or code identifiers as a concise summary.
         """
-        lines = (patch_text or "").splitlines()
-        added = [ln for ln in lines if ln.strip().startswith("+")]
+        # stop scanning once 20 '+' lines are found
+        added = [m.group(0) for m in itertools.islice(_ADDED_RE.finditer(patch_text or ""), 20)]
         if added:
-            return "\n".join(added[:20])
+            return "\n".join(added)
         # fallback: keep first N non-empty lines
-        keep = [ln for ln in lines if ln.strip()]
+        keep = [ln for ln in (patch_text or "").splitlines() if ln.strip()]
         return "\n".join(keep[:20])
 
     @retry((RetryError,), tries=3, delay=5)
@@ -143,16 +277,19 @@ class DescAligner(Agent):
         if isinstance(lambdas, dict):
             lam.update({k[0]: float(v) for k, v in lambdas.items()})  # accept {"lambda_e":0.5,...} or {"e":0.5,...}
 
-        # 1) NLI entailment on sigma(g) vs T
         sigma_g = self._sigma(patch)
-        nli = _norm01(self._nli_entail(sigma_g, texts))
-
-        # 2) CodeBLEU on code-code
-        codebleu = _norm01(self._codebleu(patch, context_code))
+        # the three signals are independent (two are network calls), so compute them concurrently
+        with ThreadPoolExecutor(max_workers=3) as ex:
+            # 1) NLI entailment on sigma(g) vs T
+            nli_f = ex.submit(self._nli_entail, sigma_g, texts)
+            # 2) CodeBLEU on code-code
+            codebleu_f = ex.submit(self._codebleu, patch, context_code)
+            # 3) cross-modal cosine via embeddings (or BoW fallback)
+            emb_f = ex.submit(self._embed_texts, [patch, texts], embed_model)
 
-        # 3) cross-modal cosine via embeddings (or BoW fallback)
-        vec_g = self._embed_text(patch, model=embed_model)
-        vec_t = self._embed_text(texts, model=embed_model)
+            nli = _norm01(nli_f.result())
+            codebleu = _norm01(codebleu_f.result())
+            vec_g, vec_t = emb_f.result()
         cos = _norm01(_cosine(vec_g, vec_t))
 
         d_aln = lam["e"] * nli + lam["b"] * codebleu + lam["c"] * cos
@@ -3,11 +3,16 @@ import logging
 from typing import Optional, Dict, Any
 from retry import retry
 
-from ..utils import read_yaml
-from ..parse import parse_code, parse_exp
+from ..utils import load_prompts
+from ..parse import parse_first_code, parse_exp
 from ..prompts.tokens import calculate_token, token_limit
 from .agent import Agent, NoCodeError
 
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROMPT_DIR = os.path.join(_BASE_DIR, "..", "prompts")
+_FIXER_PATH = os.path.join(_PROMPT_DIR, "fixer.yaml")
+_REFINE_PATH = os.path.join(_PROMPT_DIR, "refine.yaml")
+
 
 class PatchRefiner(Agent):
     """
@@ -17,10 +22,8 @@ class PatchRefiner(Agent):
     """
 
     def parse_response(self, response: str):
-        parts = parse_code(response)
-        if not parts:
-            raise NoCodeError("No code block found in model response.")
-        patch = parts[0].strip()
+        # only the first block is used, so stop at the first match
+        patch = parse_first_code(response).strip()
         if "===" in patch:
             patch = patch[: patch.find("===")].strip()
         return {"aim": patch, "exp": parse_exp(response), "ori": response}
@@ -46,9 +49,12 @@ class PatchRefiner(Agent):
         # 共享上下文（失败用例、摘要、helper等）
         self._shared_msg(info, pre_agent_resp)
 
+        # 各段先收集到 parts，最后一次性拼接，避免反复复制整段 core_msg
+        parts = [self.core_msg]
+
         # 覆盖率（若在 token 预算内）
-        if "coverage_report" in info and calculate_token(self.core_msg + info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
-            self.core_msg = "Code coverage for failed testcases:\n" + info["coverage_report"] + "\n" + self.core_msg
+        if "coverage_report" in info and calculate_token(self.core_msg, info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
+            parts.insert(0, "Code coverage for failed testcases:\n" + info["coverage_report"])
 
         # 失败原因与上一版补丁
         tail = []
@@ -70,9 +76,13 @@ class PatchRefiner(Agent):
                 tail.append("\n".join(hints))
 
         if tail:
-            self.core_msg = self.core_msg + "\n\n" + "\n".join(tail)
+            parts.append("")  # 与 tail 之间空一行
+            parts.extend(tail)
+
+        self.core_msg = "\n".join(parts)
 
-        logging.info(f"[PatchRefiner] core tokens: {calculate_token(self.core_msg)}")
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info(f"[PatchRefiner] core tokens: {calculate_token(self.core_msg)}")
 
     @retry((NoCodeError,), tries=3, delay=5)
     def run(
@@ -94,8 +104,8 @@ class PatchRefiner(Agent):
         if pre_agent_resp is None:
             pre_agent_resp = {}
 
-        fixer_prompts = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/fixer.yaml"))
-        refine_prompt = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/refine.yaml"))
+        fixer_prompts = load_prompts(_FIXER_PATH)
+        refine_prompt = load_prompts(_REFINE_PATH)
 
         if self.core_msg is None:
             self._generate_core_msg(
@@ -3,11 +3,16 @@ import logging
 from typing import Optional, Dict, Any
 from retry import retry
 
-from ..utils import read_yaml
-from ..parse import parse_code, parse_exp
+from ..utils import load_prompts
+from ..parse import parse_first_code, parse_exp
 from ..prompts.tokens import calculate_token, token_limit
 from .agent import Agent, NoCodeError
 
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROMPT_DIR = os.path.join(_BASE_DIR, "..", "prompts")
+_FIXER_PATH = os.path.join(_PROMPT_DIR, "fixer.yaml")
+_REFINE_PATH = os.path.join(_PROMPT_DIR, "refine.yaml")
+
 
 class PatchRepairer(Agent):
     """
@@ -17,10 +22,8 @@ class PatchRepairer(Agent):
     """
 
     def parse_response(self, response: str):
-        parts = parse_code(response)
-        if not parts:
-            raise NoCodeError("No code block found in model response.")
-        patch = parts[0].strip()
+        # only the first block is used, so stop at the first match
+        patch = parse_first_code(response).strip()
         if "===" in patch:
             patch = patch[: patch.find("===")].strip()
         return {"aim": patch, "exp": parse_exp(response), "ori": response}
@@ -44,9 +47,12 @@ class PatchRepairer(Agent):
         # common shared context (tests, summaries, helper, ...)
         self._shared_msg(info, pre_agent_resp)
 
+        # prepended sections are collected and joined once, instead of re-copying core_msg per prefix
+        parts = [self.core_msg]
+
         # optional coverage
-        if "coverage_report" in info and calculate_token(self.core_msg + info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
-            self.core_msg = "Code coverage for failed testcases:\n" + info["coverage_report"] + "\n" + self.core_msg
+        if "coverage_report" in info and calculate_token(self.core_msg, info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
+            parts.insert(0, "Code coverage for failed testcases:\n" + info["coverage_report"])
 
         # optional alignment/confidence signals to nudge the model
         if signals:
@@ -57,7 +63,9 @@ class PatchRepairer(Agent):
             if "C_prev" in signals:
                 hints.append(f"Previous attempt confidence (C_prev): {signals['C_prev']:.3f}.")
             if hints:
-                self.core_msg = "\n".join(hints) + "\n" + self.core_msg
+                parts[0:0] = hints
+
+        self.core_msg = "\n".join(parts)
 
         logging.info(f"Current core message tokens: {calculate_token(self.core_msg)}")
 
@@ -77,7 +85,7 @@ class PatchRepairer(Agent):
             pre_agent_resp = {}
 
         label_key = "labeled" if "locator" in pre_agent_resp else "unlabeled"
-        prompts = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/fixer.yaml"))
+        prompts = load_prompts(_FIXER_PATH)
 
         if self.core_msg is None:
             self._generate_core_msg(info, pre_agent_resp, signals=signals)
@@ -97,14 +105,14 @@ class PatchRepairer(Agent):
         signals: Optional[Dict[str, Any]] = None,
         **kwargs
     ):
-        refine_prompt = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/refine.yaml"))
+        refine_prompt = load_prompts(_REFINE_PATH)
 
         # optional signal-aware nudge
         tail_hint = ""
         if signals and "D_aln" in signals:
             tail_hint = f"\nAlignment score (D_aln): {signals['D_aln']:.3f}. Align the fix with textual intent."
 
-        fixer_prompts = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/fixer.yaml"))
+        fixer_prompts = load_prompts(_FIXER_PATH)
         label_key = "labeled" if ("locator" in (signals or {})) else "unlabeled"
 
         reply = self.send_message([
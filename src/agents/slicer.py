@@ -1,16 +1,21 @@
 import os
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from retry import retry
 
-from ..utils import read_yaml
+from ..utils import load_prompts
 from ..parse import (
     parse_code, parse_exp, is_valid_line,
-    unique_matching, search_valid_line
+    unique_matching, search_valid_line, build_line_index
 )
 from .agent import Agent, RetryError, NoCodeError
 from ..prompts.tokens import calculate_token, token_limit
 
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROMPT_DIR = os.path.join(_BASE_DIR, "..", "prompts")
+_SLICER_PATH = os.path.join(_PROMPT_DIR, "slicer.yaml")
+_REFINE_PATH = os.path.join(_PROMPT_DIR, "refine.yaml")
+
 
 class SliceAgent(Agent):
     """
@@ -19,6 +24,12 @@ class SliceAgent(Agent):
     """
 
     def parse_response(self, response: str, raw_code: str):
+        raw_lines = raw_code.splitlines()
+        real_seg, meta = self._locate(self._segment(response), raw_lines, build_line_index(raw_lines))
+        return {"aim": real_seg, "exp": parse_exp(response), "ori": response, "metrics": meta}
+
+    @staticmethod
+    def _segment(response: str) -> str:
         # 1) 收集 agent 返回的“候选片段”
         parts = [p.strip() for p in parse_code(response) if p.strip()]
         if not parts:
@@ -26,15 +37,18 @@ class SliceAgent(Agent):
         segment = "\n".join(parts)
         if "===" in segment:
             segment = segment[: segment.find("===")].strip()
+        return segment
 
+    @staticmethod
+    def _locate(segment: str, raw_lines: List[str], raw_index: Dict[str, List[int]]):
+        """ 在原代码中定位片段，返回 (real_seg, meta)；raw_index 须为 build_line_index(raw_lines) """
         seg_lines = segment.splitlines()
-        raw_lines = raw_code.splitlines()
         seg_s, seg_e = -1, -1  # raw_code 中的起止行号（0-based，闭区间）
 
         # 2) 起点：seg_lines 中从前往后选首个有效行，去 raw 中唯一匹配
         for cur, line in enumerate(seg_lines):
             if is_valid_line(line):
-                unique_idx = unique_matching(seg_lines, raw_lines, cur)
+                unique_idx = unique_matching(seg_lines, raw_lines, cur, index=raw_index)
                 if unique_idx >= 0:
                     seg_s = unique_idx
                     break
@@ -45,7 +59,7 @@ class SliceAgent(Agent):
         for cur_rev, line in enumerate(reversed(seg_lines)):
             if is_valid_line(line):
                 cur = len(seg_lines) - 1 - cur_rev  # 还原成正向索引
-                unique_idx = unique_matching(seg_lines, raw_lines, cur)
+                unique_idx = unique_matching(seg_lines, raw_lines, cur, index=raw_index)
                 if unique_idx >= 0:
                     seg_e = unique_idx
                     break
@@ -77,12 +91,12 @@ class SliceAgent(Agent):
                 seg_e = min(len(raw_lines) - 1, seg_s + len(real_seg_lines) - 1)
 
         meta = {"start": seg_s, "end": seg_e, "len": seg_e - seg_s + 1 if seg_s >= 0 and seg_e >= 0 else None}
-        return {"aim": real_seg, "exp": parse_exp(response), "ori": response, "metrics": meta}
+        return real_seg, meta
 
     def _generate_core_msg(self, info: Dict[str, Any], pre_agent_resp: Dict[str, Any]):
         self.core_msg = "The following code contains a bug:\n" + info["buggy_code"]
         self._shared_msg(info, pre_agent_resp)
-        if "coverage_report" in info and calculate_token(self.core_msg + info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
+        if "coverage_report" in info and calculate_token(self.core_msg, info["coverage_report"]) <= token_limit[self.model_name]["overall"]:
             self.core_msg = "Code coverage for failed testcases:\n" + info["coverage_report"] + "\n" + self.core_msg
         logging.info(f"Current core message tokens: {calculate_token(self.core_msg)}")
 
@@ -99,20 +113,76 @@ class SliceAgent(Agent):
         logging.info("## Running SliceAgent...")
         if pre_agent_resp is None:
             pre_agent_resp = {}
-        prompts = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/slicer.yaml"))
+        prompts = load_prompts(_SLICER_PATH)
         if self.core_msg is None:
             self._generate_core_msg(info, pre_agent_resp)
 
-        reply = self.send_message([
+        msg = [
             {"role": "system", "content": prompts["sys"]},
             {"role": "user",   "content": self.core_msg + "\n" + prompts["end"]}
-        ])
-        return self.parse_response(reply, raw_code=info["buggy_code"])
+        ]
+        raw_lines = info["buggy_code"].splitlines()
+        raw_index = build_line_index(raw_lines)
+
+        # 流式接收：代码块一闭合就开始定位，与剩余（解释部分）的生成重叠
+        chunks, early = [], None
+        for delta in self.send_message_stream(msg):
+            chunks.append(delta)
+            if early is None and "`" in delta:
+                text = "".join(chunks)
+                if text.count("```") >= 2:
+                    try:
+                        segment = self._segment(text)
+                        early = (segment, self._locate(segment, raw_lines, raw_index))
+                    except Exception:
+                        early = False
+        reply = "".join(chunks)
+
+        # 完整回复里的片段与提前定位时一致才复用（后面可能还有代码块）
+        segment = self._segment(reply)
+        if early and early[0] == segment:
+            real_seg, meta = early[1]
+        else:
+            real_seg, meta = self._locate(segment, raw_lines, raw_index)
+        return {"aim": real_seg, "exp": parse_exp(reply), "ori": reply, "metrics": meta}
+
+    def run_batch(self, infos: List[Dict[str, Any]], pre_agent_resp: Optional[Dict[str, Any]] = None):
+        """
+        Slice several bugs with one packed request (Agent.send_tasks).
+        Bugs whose answer is missing, cut off or unparsable, or the whole batch when it exceeds the budget,
+        go through run() one by one. Returns results in the order of infos.
+        """
+        if pre_agent_resp is None:
+            pre_agent_resp = {}
+        prompts = load_prompts(_SLICER_PATH)
+
+        # core_msg is per-bug here; build each one without clobbering the agent's own
+        saved, bodies = self.core_msg, []
+        for info in infos:
+            self.core_msg = None
+            self._generate_core_msg(info, pre_agent_resp)
+            bodies.append(self.core_msg)
+        self.core_msg = saved
+
+        replies = self.send_tasks(prompts["sys"], bodies, prompts["end"]) if len(infos) > 1 else None
+        results = []
+        for i, info in enumerate(infos):
+            if replies is not None and replies[i] is not None:
+                try:
+                    results.append(self.parse_response(replies[i], raw_code=info["buggy_code"]))
+                    continue
+                except Exception as e:
+                    logging.info(f"Batched slice #{i} unusable, retrying alone: {e}")
+            self.core_msg = bodies[i]
+            try:
+                results.append(self.run(info, pre_agent_resp))
+            finally:
+                self.core_msg = saved
+        return results
 
     def refine(self, assist_resp: str, *args, **kwargs):
-        prompts_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/slicer.yaml")
-        refine_prompt = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/refine.yaml"))
-        prompts = read_yaml(prompts_path)
+        refine_prompt = load_prompts(_REFINE_PATH)
+        prompts = load_prompts(_SLICER_PATH)
         reply = self.send_message([
             {"role": "system",    "content": prompts["sys"]},
             {"role": "user",      "content": self.core_msg + "\n" + prompts["end"]},
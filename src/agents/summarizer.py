@@ -1,23 +1,32 @@
 import os
-import re
 import json
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from collections import defaultdict
 from retry import retry
 
-from ..utils import read_yaml
+from ..utils import load_prompts
 from .agent import Agent, RetryError
 from ..prompts.tokens import calculate_token, token_limit
 
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROMPT_DIR = os.path.join(_BASE_DIR, "..", "prompts")
+_PROMPT_PATH = os.path.join(_PROMPT_DIR, "summarizer.yaml")
+
 
 def _extract_json_block(text: str) -> Optional[str]:
     """
     Try to extract a JSON object/array from text (handles fenced code blocks).
     """
-    m = re.search(r"```(?:json)?\s*([\s\S]*?)```", text, flags=re.IGNORECASE)
-    if m:
-        return m.group(1).strip()
+    # plain find() scan for the first fenced block; same result as ```(?:json)?\s*([\s\S]*?)``` without backtracking
+    fence = text.find("```")
+    if fence >= 0:
+        body = fence + 3
+        if text[body:body + 4].lower() == "json":
+            body += 4
+        close = text.find("```", body)
+        if close >= 0:
+            return text[body:close].strip()
     start = text.find("{")
     end = text.rfind("}")
     if 0 <= start < end:
@@ -114,7 +123,7 @@ class Summarizer(Agent):
         *args, **kwargs
     ):
         logging.info("## Running Summarizer...")
-        prompts = read_yaml(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../prompts/summarizer.yaml"))
+        prompts = load_prompts(_PROMPT_PATH)
 
         if code is None and info is not None:
             code = info.get("buggy_code", "")
@@ -123,4 +132,50 @@ class Summarizer(Agent):
             {"role": "system", "content": prompts["sys"]},
             {"role": "user",   "content": "Raw Code:\n" + (code or "") + "\n" + prompts["end"]}
         ])
-        return self.parse_response(reply)
\ No newline at end of file
+        return self.parse_response(reply)
+
+    def pack(self, codes: Dict[str, str]) -> List[List[str]]:
+        """
+        Group file names into bins for run_batch: first-fit decreasing on code tokens (plus the
+        per-task marker overhead) so each bin stays within token_limit[model]["buggy_code"] on input.
+        On output every file is expected to need the agent's max_tokens, as a single run() allows,
+        so a bin holds at most max_packed_tasks() files and the packed reply fits its output budget.
+        A file larger than the input budget gets a bin of its own. Bins list names in input order.
+        """
+        budget = token_limit[self.model_name]["buggy_code"]
+        max_files = self.max_packed_tasks()
+        overhead = calculate_token("===TASK 00===\nRaw Code:\n\n\n")
+        cost = {name: calculate_token(code or "") + overhead for name, code in codes.items()}
+        bins: List[List[str]] = []
+        room: List[int] = []
+        for name in sorted(codes, key=cost.get, reverse=True):
+            for i, left in enumerate(room):
+                if cost[name] <= left and len(bins[i]) < max_files:
+                    bins[i].append(name)
+                    room[i] -= cost[name]
+                    break
+            else:
+                bins.append([name])
+                room.append(budget - cost[name])
+        order = {name: i for i, name in enumerate(codes)}
+        return [sorted(b, key=order.get) for b in bins]
+
+    def run_batch(self, codes: List[str]):
+        """
+        Summarize several code texts with one packed request (Agent.send_tasks).
+        Codes whose answer is missing, cut off or unparsable, or all of them when the batch exceeds the budget,
+        go through run() one by one. Returns results in the order of codes.
+        """
+        prompts = load_prompts(_PROMPT_PATH)
+        bodies = ["Raw Code:\n" + (code or "") for code in codes]
+        replies = self.send_tasks(prompts["sys"], bodies, prompts["end"]) if len(codes) > 1 else None
+        results = []
+        for i, code in enumerate(codes):
+            if replies is not None and replies[i] is not None:
+                try:
+                    results.append(self.parse_response(replies[i]))
+                    continue
+                except Exception as e:
+                    logging.info(f"Batched summary #{i} unusable, retrying alone: {e}")
+            results.append(self.run(code))
+        return results
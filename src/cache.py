@@ -0,0 +1,77 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from .utils import content_hash
+
+
+def _normalize_code(code: str) -> str:
+    """只统一换行符与行尾空白；缩进、注释等都会进入 prompt，必须原样参与键。"""
+    return "\n".join(line.rstrip() for line in (code or "").splitlines())
+
+
+class AgentCache:
+    """
+    Persistent (role, model, bug content, upstream context) -> response_dict cache backed by sqlite.
+    Lets repeated experiments on the same bugs skip agent calls entirely. Keys include the bug name and
+    the buggy code as sent to the model; only line endings and trailing whitespace are normalized.
+    Least-recently-used entries are evicted beyond max_entries. Safe across threads.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            parent = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(parent, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS agent_resp "
+                "(key TEXT PRIMARY KEY, resp TEXT NOT NULL, used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS agent_resp_used ON agent_resp (used)")
+        return self._conn
+
+    @staticmethod
+    def key(role: str, model_name: str, info: Dict[str, Any], pre_agent_resp: Dict[str, Any]) -> str:
+        serial = json.dumps(
+            [role, model_name, info.get("project_meta", {}).get("bug_name", ""),
+             _normalize_code(info.get("buggy_code", "")),
+             info.get("failing_test_cases", ""), pre_agent_resp],
+            sort_keys=True, default=str,
+        )
+        return content_hash(serial)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT resp FROM agent_resp WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE agent_resp SET used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, resp: Dict[str, Any]) -> None:
+        try:
+            text = json.dumps(resp, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logging.debug(f"[AgentCache] skip unserializable response: {e}")
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO agent_resp (key, resp, used) VALUES (?, ?, ?)", (key, text, time.time()))
+            conn.execute(
+                "DELETE FROM agent_resp WHERE key IN "
+                "(SELECT key FROM agent_resp ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
@@ -1,10 +1,14 @@
+import sys
 import logging
-from typing import Any, Optional, Tuple
+import weakref
+import functools
+from collections import Counter
+from typing import Any, Dict, Iterator, Optional, Tuple
 
 # 尝试懒加载依赖（javalang / APTED）
 try:
     import javalang
-    from apted import APTED  # Config 可选，不强依赖
+    from apted import APTED, Config
     _HAS_JAVA = True
 except Exception as e:
     logging.warning(f"[myast] AST deps not available: {e}")
@@ -12,14 +16,40 @@ except Exception as e:
 
 AstTuple = Optional[Tuple[str, list]]
 
+# 已转换的整棵树，按根节点身份缓存；AST 被回收后条目自动消失
+_TUPLE_CACHE: "weakref.WeakKeyDictionary[Any, AstTuple]" = weakref.WeakKeyDictionary()
+# 节点类 -> 驻留后的类名；所有树里同名标签都是同一个 str 对象
+_LABEL_INTERN: Dict[type, str] = {}
+# 同一棵树的节点标签多重集（先序遍历时顺带收集），用于 ast_dis 的下界剪枝
+_LABEL_CACHE: "weakref.WeakKeyDictionary[Any, Counter]" = weakref.WeakKeyDictionary()
+# 已算出的精确编辑距离：tree1 -> {tree2: dis}，任一棵树被回收后条目随之消失
+_DIS_CACHE: "weakref.WeakKeyDictionary[Any, weakref.WeakKeyDictionary]" = weakref.WeakKeyDictionary()
+
+if _HAS_JAVA:
+    class _TupleConfig(Config):
+        """让 APTED 直接读取 (label, children) 元组，无需再包一层节点对象。"""
+
+        def rename(self, node1, node2):
+            # 标签经 _label 驻留，身份比较即等价于相等比较
+            return int(node1[0] is not node2[0])
+
+        def children(self, node):
+            return node[1]
+
 
 def code2ast(code: str, language: str = "java") -> Optional[Any]:
     """
     Parse source code to AST. Currently supports Java via javalang.
     Returns None if deps missing or language unsupported / parse failed.
+    相同代码只解析一次并返回同一棵树（调用方不应修改返回的 AST）。
     """
     if language.lower() != "java" or not _HAS_JAVA:
         return None
+    return _parse_java(code)
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_java(code: str) -> Optional[Any]:
     try:
         return javalang.parse.parse(code)
     except Exception as e:
@@ -27,39 +57,83 @@ def code2ast(code: str, language: str = "java") -> Optional[Any]:
         return None
 
 
+def _child_nodes(node: Any) -> Iterator[Any]:
+    """逐个产出 javalang 节点的子节点；属性值里的 list/set 会被展开。"""
+    for child in node.children:
+        if isinstance(child, javalang.ast.Node):
+            yield child
+        elif isinstance(child, (list, tuple, set)):
+            for c in child:
+                if isinstance(c, javalang.ast.Node):
+                    yield c
+
+
+def _label(cls: type) -> str:
+    s = _LABEL_INTERN.get(cls)
+    if s is None:
+        s = _LABEL_INTERN[cls] = sys.intern(cls.__name__)
+    return s
+
+
+def _to_tuple(node: Any, labels: list) -> Tuple[str, list]:
+    labels.append(label := _label(node.__class__))
+    return (label, [_to_tuple(c, labels) for c in _child_nodes(node)])
+
+
 def ast_to_tuple(node: Any) -> AstTuple:
     """
     Convert AST to a (TypeName, [children...]) tuple that APTED 接口可接受。
     None-safe：传入非 javalang 节点或 None → 返回 None。
+    同一棵树重复转换时直接返回缓存结果。
     """
-    if not _HAS_JAVA or node is None:
+    if not _HAS_JAVA or not isinstance(node, javalang.ast.Node):
         return None
-    if isinstance(node, javalang.ast.Node):
-        children = []
+    if (t := _TUPLE_CACHE.get(node)) is None:
+        labels: list = []
         try:
-            for _, child in node.children():
-                t = ast_to_tuple(child)
-                if t is not None:
-                    children.append(t)
-        except Exception:
-            pass
-        return (node.__class__.__name__, children)
-    return None
+            t = _TUPLE_CACHE[node] = _to_tuple(node, labels)
+            _LABEL_CACHE[node] = Counter(labels)
+        except Exception as e:
+            logging.warning(f"[myast] tupleize failed: {e}")
+            return None
+    return t
+
+
+def ast_lower_bound(tree1: Any, tree2: Any) -> Optional[int]:
+    """
+    Cheap lower bound on the tree edit distance: max(n1, n2) minus the size of the shared label multiset.
+    It is never below |n1 - n2| or half the label-multiset difference. 任一为空 → None。
+    """
+    if ast_to_tuple(tree1) is None or ast_to_tuple(tree2) is None:
+        return None
+    c1, c2 = _LABEL_CACHE[tree1], _LABEL_CACHE[tree2]
+    return max(sum(c1.values()), sum(c2.values())) - sum((c1 & c2).values())
 
 
-def ast_dis(tree1: Any, tree2: Any) -> Optional[int]:
+def ast_dis(tree1: Any, tree2: Any, threshold: Optional[int] = None) -> Optional[int]:
     """
     Compute tree edit distance via APTED on tupleized ASTs.
     任一为空 → 返回 None 表示无法度量。
+    threshold: 若下界已超过该值，直接返回下界，跳过 O(n^3) 的 APTED 计算。
     """
     if not _HAS_JAVA:
         return None
     t1, t2 = ast_to_tuple(tree1), ast_to_tuple(tree2)
     if t1 is None or t2 is None:
         return None
+    # 距离对称，两个方向都查
+    for a, b in ((tree1, tree2), (tree2, tree1)):
+        hit = _DIS_CACHE.get(a)
+        if hit is not None and (dis := hit.get(b)) is not None:
+            return dis
+    if threshold is not None:
+        bound = ast_lower_bound(tree1, tree2)
+        if bound > threshold:
+            return bound
     try:
-        apted = APTED(t1, t2)
-        return apted.compute()
+        dis = APTED(t1, t2, _TupleConfig()).compute_edit_distance()
+        _DIS_CACHE.setdefault(tree1, weakref.WeakKeyDictionary())[tree2] = dis
+        return dis
     except Exception as e:
         logging.warning(f"[myast] APTED compute failed: {e}")
         return None
@@ -1,6 +1,7 @@
 import re
 import logging
-from typing import List, Optional, Tuple
+import functools
+from typing import Dict, Iterator, List, Optional, Tuple
 
 
 class NoCodeError(Exception):
@@ -9,75 +10,139 @@ class NoCodeError(Exception):
         self.message = message
 
 
+# 代码块模式，按优先级排列
+_CODE_PATTERNS = [re.compile(p, re.DOTALL) for p in (
+    r'```(?:[^\n]*\n)?(.*?)```',
+    r'```(?:[^\n]*\n)?(.*?)===',
+    r'^(.*?)```',
+    r'`(?:[^\n]*\n)?(.*?)`',
+    r'```(?:[^\n]*\n)?(.*?)$',
+)]
+
+
 def parse_code(text: str) -> List[str]:
     """
     提取代码块：优先 ```...```；其次 === 分隔；最后行内 `
     返回匹配到的代码块列表；若一个也没有则抛 NoCodeError。
     """
-    patterns = [
-        r'```(?:[^\n]*\n)?(.*?)```',
-        r'```(?:[^\n]*\n)?(.*?)===',
-        r'^(.*?)```',
-        r'`(?:[^\n]*\n)?(.*?)`',
-        r'```(?:[^\n]*\n)?(.*?)$',
-    ]
-    for pat in patterns:
-        tmp = re.findall(pat, text, re.DOTALL)
+    for pat in _CODE_PATTERNS:
+        tmp = pat.findall(text)
         if tmp and tmp[0].strip():
             return tmp
     raise NoCodeError(f"Cannot extract any code from:\n@@@@@\n{text}\n@@@@@\n")
 
 
+def parse_first_code(text: str) -> str:
+    """
+    等价于 parse_code(text)[0]，但每个模式只 search 第一个匹配，不扫描全文收集所有代码块。
+    """
+    for pat in _CODE_PATTERNS:
+        m = pat.search(text)
+        if m and m.group(1).strip():
+            return m.group(1)
+    raise NoCodeError(f"Cannot extract any code from:\n@@@@@\n{text}\n@@@@@\n")
+
+
+# 解释块模式，按优先级排列
+_EXP_PATTERNS = [re.compile(p, re.DOTALL) for p in (
+    r'===(?:[^\n]*\n)?(.*?)===',
+    r'===(?:[^\n]*\n)?(.*?)$',
+    r'^(?:[^\n]*\n)?(.*?)```',
+)]
+
+
 def parse_exp(text: str) -> str:
     """
     提取解释块：优先 === ... ===；否则到结尾；否则到 ``` 之前。
     """
-    patterns = [
-        r'===(?:[^\n]*\n)?(.*?)===',
-        r'===(?:[^\n]*\n)?(.*?)$',
-        r'^(?:[^\n]*\n)?(.*?)```',
-    ]
-    for pat in patterns:
-        tmp = re.findall(pat, text, re.DOTALL)
+    for pat in _EXP_PATTERNS:
+        tmp = pat.findall(text)
         if tmp:
             return "\n".join(tmp)
     logging.warning("This response doesn't explain the repairing")
     return ""
 
 
+_BLOCK_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+_LINE_COMMENT_RE = re.compile(r'//.*')
+_BLANK_LINE_RE = re.compile(r'^\s*$', re.MULTILINE)
+
+
+def _strip_block_comments(code: str) -> str:
+    """
+    与 _BLOCK_COMMENT_RE.sub('', code) 结果相同，但避免平方级扫描：
+    未闭合的 /* 会让正则对其后每个 /* 都重新扫到结尾。最后一个 */ 之后不可能再有匹配，
+    只对它之前的部分做替换即可，其中每次扫描都必然闭合。
+    """
+    close = code.rfind("*/")
+    if close < 0:
+        return code
+    return _BLOCK_COMMENT_RE.sub('', code[:close + 2]) + code[close + 2:]
+
+
 def remove_comment(code: str) -> str:
-    code = re.sub(r'/\*.*?\*/', '', code, flags=re.DOTALL)
-    code = re.sub(r'//.*', '', code)
-    return re.sub(r'^\s*$', '', code, flags=re.MULTILINE)  # 移除空行
+    code = _strip_block_comments(code)
+    if "//" in code:
+        code = _LINE_COMMENT_RE.sub('', code)
+    return _BLANK_LINE_RE.sub('', code)  # 移除空行
 
 
 def remove_whitespace(line: str) -> str:
+    # 两次 replace 在短行上比 str.translate 快数倍，保持不变
     return line.replace('\n', '').replace(' ', '')
 
 
 def two_lines_match(line1: Optional[str], line2: Optional[str]) -> bool:
     """
     忽略注释/空白后的行匹配。两行都需要非空。
+    注释行对注释行完全比较，否则去掉行尾注释后再比（见 line_key）。
     """
-    if not line1 or not line2:
-        return False
-    s1, s2 = line1.strip(), line2.strip()
-    if not s1 or not s2:
-        return False
-    # 注释行对注释行：完全比较
-    if s1.startswith("//") and s2.startswith("//"):
-        return bool(remove_whitespace(s1) and remove_whitespace(s2) and remove_whitespace(s1) == remove_whitespace(s2))
-    # 否则去掉行尾注释后再比
-    l1 = remove_whitespace(line1.split("//")[0])
-    l2 = remove_whitespace(line2.split("//")[0])
-    return bool(l1 and l2 and l1 == l2)
+    return two_lines_match_norm(line_key(line1), line_key(line2))
+
+
+def two_lines_match_norm(key1: Optional[str], key2: Optional[str]) -> bool:
+    """ 在已归一化的 line_key 上比较，供循环中复用同一侧的 key """
+    return key1 is not None and key1 == key2
+
+
+@functools.lru_cache(maxsize=4096)
+def line_key(line: Optional[str]) -> Optional[str]:
+    """
+    two_lines_match 所比较的归一化形式：两行匹配当且仅当二者 key 相同且非 None。
+    注释行保留整行（以 // 开头），代码行只取 // 之前的部分，二者不会冲突。
+    同一份代码的行会被反复比较，故缓存。
+    """
+    if not line:
+        return None
+    s = line.strip()
+    if not s:
+        return None
+    if s.startswith("//"):
+        return remove_whitespace(s)
+    return remove_whitespace(line.split("//")[0]) or None
 
 
-def exist_line(line: str, mylst: Optional[List[str]]) -> bool:
+def build_line_index(code_lines: List[str]) -> Dict[str, List[int]]:
+    """
+    归一化行 -> 行号列表（升序）。对同一份代码建一次索引，
+    之后的逐行匹配从 O(len(code_lines)) 降为一次字典查找。
+    """
+    index: Dict[str, List[int]] = {}
+    for i, key in enumerate(map(line_key, code_lines)):
+        if key is not None:
+            index.setdefault(key, []).append(i)
+    return index
+
+
+def exist_line(line: str, mylst: Optional[List[str]], index: Optional[Dict[str, List[int]]] = None) -> bool:
+    """ index 若给出，须为 build_line_index(mylst) """
     if mylst is None:
         return True
+    key = line_key(line)
+    if index is not None:
+        return key is not None and key in index
     for l in mylst:
-        if two_lines_match(l, line):
+        if two_lines_match_norm(key, line_key(l)):
             return True
     return False
 
@@ -88,12 +153,12 @@ def is_valid_line(line: str, length: int = 0) -> bool:
     """
     if line is None:
         return False
-    nowh = remove_whitespace(line)
-    if len(nowh) <= length:
-        return False
     s = line.strip()
     if not s:
         return False
+    # 空白行已被上面排除，length<=0 时无需再去空格计长
+    if length > 0 and len(remove_whitespace(line)) <= length:
+        return False
     if s[0] == "+":
         return False
     if "missing" in line or "buggy" in line:
@@ -102,14 +167,16 @@ def is_valid_line(line: str, length: int = 0) -> bool:
 
 
 def search_valid_line(lines: List[str], start_idx: int, mode: str,
-                      degree: int = 1, existing: Optional[List[str]] = None) -> Optional[Tuple[int, str]]:
+                      degree: int = 1, existing: Optional[List[str]] = None,
+                      index: Optional[Dict[str, List[int]]] = None) -> Optional[Tuple[int, str]]:
     """
     从 start_idx 向前(pre)/向后(post)找第 degree 个有效行（存在于 existing 列表）。
+    index 若给出，须为 build_line_index(existing)。
     """
     incre = -1 if mode == "pre" else 1
     cur_idx = start_idx + incre
     while 0 <= cur_idx < len(lines):
-        if is_valid_line(lines[cur_idx]) and exist_line(lines[cur_idx], existing):
+        if is_valid_line(lines[cur_idx]) and exist_line(lines[cur_idx], existing, index=index):
             degree -= 1
             if degree == 0:
                 return (cur_idx, lines[cur_idx])
@@ -117,48 +184,98 @@ def search_valid_line(lines: List[str], start_idx: int, mode: str,
     return None
 
 
+def _valid_keys(lines: List[str], start_idx: int, mode: str, existing: Optional[List[str]] = None,
+                index: Optional[Dict[str, List[int]]] = None) -> Iterator[Optional[str]]:
+    """
+    依次产出 start_idx 前(pre)/后(post)第 1, 2, ... 个有效行的 line_key，
+    第 k 次产出等价于 search_valid_line(..., degree=k)，但整个方向只扫一遍。
+    """
+    incre = -1 if mode == "pre" else 1
+    for cur_idx in range(start_idx + incre, -1 if incre < 0 else len(lines), incre):
+        line = lines[cur_idx]
+        if is_valid_line(line) and exist_line(line, existing, index=index):
+            yield line_key(line)
+
+
 def matching_with_comments(aim_line: str, matched: List[int], code_lines: List[str]) -> List[int]:
     """ 完全匹配（含注释/空格归一） """
-    return [m for m in matched if remove_whitespace(aim_line) == remove_whitespace(code_lines[m])]
+    aim = remove_whitespace(aim_line)
+    return [m for m in matched if aim == remove_whitespace(code_lines[m])]
 
 
-def matching_lines(aim_line: Optional[str], code_lines: List[str], stop_at_first_match: bool = False) -> List[int]:
+def matching_lines(aim_line: Optional[str], code_lines: List[str], stop_at_first_match: bool = False,
+                   index: Optional[Dict[str, List[int]]] = None) -> List[int]:
+    """ index 若给出，须为 build_line_index(code_lines) """
     if aim_line is None:
         return []
+    key = line_key(aim_line)
+    if index is not None:
+        hits = index.get(key, []) if key is not None else []
+        return hits[:1] if stop_at_first_match else list(hits)
     out = []
     for idx, cl in enumerate(code_lines):
-        if two_lines_match(aim_line, cl):
+        if two_lines_match_norm(key, line_key(cl)):
             out.append(idx)
             if stop_at_first_match:
                 return [idx]
     return out
 
 
+def matching_lines_limited(aim_line: Optional[str], code_lines: List[str], limit: int = 2,
+                           index: Optional[Dict[str, List[int]]] = None) -> List[int]:
+    """
+    最多返回前 limit 个匹配行号，找够即停；用于只需区分 0 / 1 / 多个匹配的场合。
+    index 若给出，须为 build_line_index(code_lines)。
+    """
+    if aim_line is None:
+        return []
+    key = line_key(aim_line)
+    if index is not None:
+        return index.get(key, [])[:limit] if key is not None else []
+    out = []
+    for idx, cl in enumerate(code_lines):
+        if two_lines_match_norm(key, line_key(cl)):
+            out.append(idx)
+            if len(out) >= limit:
+                break
+    return out
+
+
+_EXHAUSTED = object()
+
+
 def matching_neighbor(aim_codes: List[str], aim_idx: int, raw_codes: List[str],
-                      matched: List[int], existing: bool = False, degree_limit: int = 5) -> List[int]:
+                      matched: List[int], existing: bool = False, degree_limit: int = 5,
+                      index: Optional[Dict[str, List[int]]] = None) -> List[int]:
     """
     通过邻接行 disambiguation：向前/向后逐级寻找匹配，尝试唯一化。
+    index 若给出，须为 build_line_index(raw_codes)。
     """
     existing_pool = raw_codes if existing else None
+    existing_index = index if existing else None
     pre_now, post_now = list(matched), list(matched)
     pre_also, post_also = [], []
 
-    for degree in range(1, degree_limit + 1):
-        aim_pre = search_valid_line(aim_codes, aim_idx, "pre", degree=degree, existing=existing_pool)
-        aim_post = search_valid_line(aim_codes, aim_idx, "post", degree=degree, existing=existing_pool)
+    # 每个方向一个游标：第 degree 轮取下一个有效行，而不是每轮从头再数 degree 个
+    aim_pre_keys = _valid_keys(aim_codes, aim_idx, "pre", existing=existing_pool, index=existing_index)
+    aim_post_keys = _valid_keys(aim_codes, aim_idx, "post", existing=existing_pool, index=existing_index)
+    # 候选只会在连续各轮都匹配时留下，其游标恰好推进了 degree-1 次
+    pre_keys = {mi: _valid_keys(raw_codes, mi, "pre") for mi in matched}
+    post_keys = {mi: _valid_keys(raw_codes, mi, "post") for mi in matched}
 
-        if aim_pre is not None:
+    for degree in range(1, degree_limit + 1):
+        aim_key = next(aim_pre_keys, _EXHAUSTED)
+        if aim_key is not _EXHAUSTED:
             for mi in pre_now:
-                pre_match = search_valid_line(raw_codes, mi, "pre", degree=degree)
-                if (pre_match is not None) and two_lines_match(aim_pre[1], pre_match[1]):
+                if two_lines_match_norm(aim_key, next(pre_keys[mi], None)):
                     pre_also.append(mi)
             if len(pre_also) == 1:
                 return pre_also
 
-        if aim_post is not None:
+        aim_key = next(aim_post_keys, _EXHAUSTED)
+        if aim_key is not _EXHAUSTED:
             for mi in post_now:
-                post_match = search_valid_line(raw_codes, mi, "post", degree=degree)
-                if (post_match is not None) and two_lines_match(aim_post[1], post_match[1]):
+                if two_lines_match_norm(aim_key, next(post_keys[mi], None)):
                     post_also.append(mi)
             if len(post_also) == 1:
                 return post_also
@@ -176,19 +293,24 @@ def matching_neighbor(aim_codes: List[str], aim_idx: int, raw_codes: List[str],
 
 
 def unique_matching(resp_lines: List[str], code_lines: List[str], resp_cur_idx: int,
-                    resp_cur_line: Optional[str] = None, existing: bool = False) -> int:
+                    resp_cur_line: Optional[str] = None, existing: bool = False,
+                    index: Optional[Dict[str, List[int]]] = None) -> int:
     """
     将响应中的某一行在原代码中唯一定位；返回唯一匹配的下标；
     若 0 个匹配 → -2；若多匹配但未唯一化 → -1。
+    index 若给出，须为 build_line_index(code_lines)。
     """
     target = resp_lines[resp_cur_idx] if resp_cur_line is None else resp_cur_line
-    matched = matching_lines(target, code_lines)
+    # 先找至多 2 个匹配判断是否唯一；确有歧义时才取全部候选
+    matched = matching_lines_limited(target, code_lines, limit=2, index=index)
     if len(matched) == 1:
         return matched[0]
     if len(matched) == 0:
         return -2
+    matched = matching_lines(target, code_lines, index=index)
 
-    neighbor = matching_neighbor(resp_lines, resp_cur_idx, code_lines, matched, degree_limit=5, existing=existing)
+    neighbor = matching_neighbor(resp_lines, resp_cur_idx, code_lines, matched, degree_limit=5, existing=existing,
+                                 index=index)
     if len(neighbor) == 1:
         return neighbor[0]
     logging.debug(f"unique_matching failed for '{target}' with {len(matched)} candidates")
@@ -1,9 +1,14 @@
 # src/patch.py
+import io
 import os
 import re
+import time
 import logging
-import signal
-from typing import List, Optional
+import tarfile
+import functools
+import threading
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
 
 from .parse import (
     NoCodeError,
@@ -11,13 +16,27 @@ from .parse import (
     matching_with_comments,
     unique_matching,
     search_valid_line,
+    build_line_index,
 )
 
-class TimeoutException(Exception):
-    pass
-
-def timeout_handler(signum, frame):
-    raise TimeoutException("TimeOut")
+# 预编译的补丁/代码行模式
+_HUNK_SPLIT_RE = re.compile(r'(@@[\s\d\+\-\,]+@@)(\s+[^\n]+)')
+# hunk 头（group 1）或 -/+ 改动行，供 _is_a_patch 单趟判断
+_HUNK_OR_SIGN_RE = re.compile(r'^(?:(@@\s-\d+,\d+\s\+\d+,\d+\s@@)|[-+]\s)')
+_MINUS_RE = re.compile(r'^[-](\s|\t)+.*$')
+_PLUS_RE = re.compile(r'^[+](\s|\t)+.*$')
+_TRAILING_WORD_RE = re.compile(r'[A-Za-z0-9]$')
+_FAILING_RE = re.compile(r'Failing tests:\s*(\d+)')
+_MODIFIERS = frozenset(("public", "private", "protected"))
+# defects4j test 的超时（秒）；由容器内的 timeout 命令执行，可在任意线程调用
+_TEST_TIMEOUT = 5 * 60
+
+# (container_id, checkout 目录, 缺陷文件) -> 原始缺陷代码；命中时复用已有 checkout，只覆盖该文件
+_CHECKOUTS: Dict[Tuple[str, str, str], str] = {}
+# (container_id, checkout 目录) -> 锁：同一 checkout 上的 checkout/写文件/编译/测试必须串行（不论改的是哪个文件）；
+# 不同 checkout 之间可以并发
+_DIR_LOCKS: Dict[Tuple[str, str], threading.Lock] = {}
+_CHECKOUTS_LOCK = threading.Lock()
 
 class NotPatchError(Exception):
     def __init__(self, message: str):
@@ -27,7 +46,7 @@ class NotPatchError(Exception):
 
 def _format_patch_lines(patch: str) -> List[str]:
     # 把 @@ hunk 头与紧随其后的首行代码拆行，便于逐行处理
-    return re.compile(r'(@@[\s\d\+\-\,]+@@)(\s+[^\n]+)').sub(r'\1\n\2', patch).splitlines()
+    return _HUNK_SPLIT_RE.sub(r'\1\n\2', patch).splitlines()
 
 def _format_code(code_lines: List[str]) -> List[str]:
     """
@@ -35,29 +54,39 @@ def _format_code(code_lines: List[str]) -> List[str]:
     依据原 FixAgent 的启发式，维持兼容。
     """
     out = list(code_lines)
-    for i, line in enumerate(list(out)):
-        concat = False
-        for k in ["public", "private", "protected"]:
-            if line.replace(" ", "") == k:
-                concat = True
-                out[i] = ""
-                if i + 1 < len(out):
-                    out[i + 1] = k + " " + out[i + 1].lstrip()
-                break
-
-        if (not concat and i < len(out) - 1 and "class" not in line
+    last = len(out) - 1
+    # 判断条件始终看原始行（code_lines 不被修改），拼接结果写入 out
+    for i, line in enumerate(code_lines):
+        k = line.replace(" ", "")
+        if k in _MODIFIERS:
+            out[i] = ""
+            if i < last:
+                out[i + 1] = k + " " + out[i + 1].lstrip()
+            continue
+
+        if (i < last and "class" not in line
                 and not line.strip().startswith("*")
                 and ("//" not in line and "/*" not in line)
-                and re.search(r'[A-Za-z0-9]$', line or "")):
+                and _TRAILING_WORD_RE.search(line or "")):
             # 把“被错误换行”的两行拼回去
             out[i] = (line or "").rstrip() + " " + (out[i + 1] or "").lstrip()
             out[i + 1] = ""
     return out
 
 def _is_a_patch(patch_lines: List[str]) -> bool:
-    has_hunk = any(re.match(r'^@@\s-\d+,\d+\s\+\d+,\d+\s@@.*', (ln or '').strip()) for ln in patch_lines)
-    has_sign = any(re.match(r'^[-+](\s|\t)+.*$', (ln or '').strip()) for ln in patch_lines)
-    return bool(has_hunk and has_sign)
+    # 一趟扫描同时找 hunk 头与 -/+ 行，两者都见到即返回
+    has_hunk = has_sign = False
+    for ln in patch_lines:
+        m = _HUNK_OR_SIGN_RE.match((ln or '').strip())
+        if m is None:
+            continue
+        if m.group(1):
+            has_hunk = True
+        else:
+            has_sign = True
+        if has_hunk and has_sign:
+            return True
+    return False
 
 def _find_a_matched_line(
     pidx: int,
@@ -65,11 +94,14 @@ def _find_a_matched_line(
     code_lines: List[str],
     patch_lines: List[str],
     lag: int = -1,
-    existing: bool = False
+    existing: bool = False,
+    index: Optional[Dict[str, List[int]]] = None
 ) -> int:
-    matched = matching_lines(pline, code_lines)
+    """ index 若给出，须为 build_line_index(code_lines) """
+    matched = matching_lines(pline, code_lines, index=index)
     if lag >= 0:
-        matched = [m for m in matched if m > lag]
+        # matching_lines 返回升序行号，二分定位第一个 > lag 的位置
+        matched = matched[bisect_right(matched, lag):]
     if len(matched) == 1:
         return matched[0]
 
@@ -77,7 +109,7 @@ def _find_a_matched_line(
     if len(perfect) == 1:
         return perfect[0]
 
-    return unique_matching(patch_lines, code_lines, pidx, resp_cur_line=pline, existing=existing)
+    return unique_matching(patch_lines, code_lines, pidx, resp_cur_line=pline, existing=existing, index=index)
 
 def patching(patch: str, raw_code_lines: List[str]) -> str:
     """
@@ -90,60 +122,77 @@ def patching(patch: str, raw_code_lines: List[str]) -> str:
 
     assert isinstance(raw_code_lines, list)
     code_lines = _format_code(raw_code_lines)
+    # code_lines 在打补丁过程中不变（改动都写在 patched 上），索引只建一次
+    code_index = build_line_index(code_lines)
 
     # 目标：在 code_lines 上，按 -/+ 序列执行删除/替换/插入
+    # patched[i] 是第 i 行的当前内容（"" 表示删除，可含 \n 追加行）；
+    # inserted[i] 是插在第 i 行之前的新行，二者分开存放，元素类型始终是 str
     patched = list(code_lines)
+    inserted: Dict[int, List[str]] = {}
     unpatched = []
     to_patch = 0
     replace_idx, prev_patch_idx = -1, -1  # 记录上一处变更位置与行
+    # 上一条 + 行的去向：None 表示接在 patched[replace_idx] 之后；整数 k 表示在 inserted[replace_idx] 的第 k 位，
+    # 紧随其后的 + 行继续放在同一处
+    add_at: Optional[int] = None
 
     for pidx, pline in enumerate(patch_lines):
-        if re.search(r'^[-](\s|\t)+.*$', pline or ""):  # 删除
+        if _MINUS_RE.match(pline or ""):  # 删除
             to_patch += 1
             if prev_patch_idx >= 0 and prev_patch_idx + 1 == pidx and patch_lines[prev_patch_idx].startswith('-'):
                 # 连续多行删除
                 if replace_idx + 1 < len(patched):
                     patched[replace_idx + 1] = ""
+                    inserted.pop(replace_idx + 1, None)
                 replace_idx, prev_patch_idx = replace_idx + 1, pidx
             else:
                 match_idx = _find_a_matched_line(
                     pidx, (pline or "")[1:].lstrip(), code_lines, patch_lines,
-                    lag=replace_idx, existing=True
+                    lag=replace_idx, existing=True, index=code_index
                 )
                 if match_idx >= 0:
                     patched[match_idx] = ""
+                    inserted.pop(match_idx, None)
                     replace_idx, prev_patch_idx = match_idx, pidx
                 else:
                     logging.warning(f"Cannot patch {pline}!")
                     unpatched.append((pidx, pline))
 
-        elif re.search(r'^[+](\s|\t)+.*$', pline or ""):  # 新增
+        elif _PLUS_RE.match(pline or ""):  # 新增
             to_patch += 1
             if prev_patch_idx >= 0 and prev_patch_idx + 1 == pidx:
                 # 与上一行（可能是 - 或 +）形成“替换或多行追加”
                 if patch_lines[prev_patch_idx].startswith('-'):
                     patched[replace_idx] = (pline or "")[1:].rstrip()
+                    inserted.pop(replace_idx, None)
+                    add_at = None
                 elif patch_lines[prev_patch_idx].startswith('+'):
-                    if isinstance(patched[replace_idx], str):
+                    if add_at is not None:
+                        add_at += 1
+                        inserted[replace_idx].insert(add_at, (pline or "")[1:].rstrip())
+                    else:
                         patched[replace_idx] += ("\n" + (pline or "")[1:].rstrip())
-                    elif isinstance(patched[replace_idx], list):
-                        patched[replace_idx] = patched[replace_idx][:-1] + [(pline or "")[1:].rstrip(), patched[replace_idx][-1]]
                 prev_patch_idx = pidx
             else:
                 # 尝试“邻居定位”后再插入
                 pre_valid = search_valid_line(patch_lines, pidx, "pre")
                 if pre_valid is not None:
-                    unique_idx = _find_a_matched_line(pre_valid[0], pre_valid[1], code_lines, patch_lines, lag=replace_idx)
+                    unique_idx = _find_a_matched_line(pre_valid[0], pre_valid[1], code_lines, patch_lines, lag=replace_idx,
+                                                      index=code_index)
                     if unique_idx >= 0:
                         patched[unique_idx] += ("\n" + (pline or "")[1:].rstrip())
                         replace_idx, prev_patch_idx = unique_idx, pidx
+                        add_at = None
                         continue
-                post_valid = search_valid_line(patch_lines, pidx, "post", existing=code_lines)
+                post_valid = search_valid_line(patch_lines, pidx, "post", existing=code_lines, index=code_index)
                 if post_valid is not None:
-                    unique_idx = _find_a_matched_line(post_valid[0], post_valid[1], code_lines, patch_lines, lag=replace_idx)
+                    unique_idx = _find_a_matched_line(post_valid[0], post_valid[1], code_lines, patch_lines, lag=replace_idx,
+                                                      index=code_index)
                     if unique_idx >= 0:
-                        patched[unique_idx] = [(pline or "")[1:].rstrip(), patched[unique_idx]]
+                        inserted[unique_idx] = [(pline or "")[1:].rstrip()] + inserted.get(unique_idx, [])
                         replace_idx, prev_patch_idx = unique_idx, pidx
+                        add_at = 0
                         continue
 
                 logging.warning(f"Cannot patch! {pline}")
@@ -159,15 +208,14 @@ def patching(patch: str, raw_code_lines: List[str]) -> str:
 
     # 拼回文本
     res = []
-    for p in patched:
-        if not p:
-            continue
-        if isinstance(p, str):
+    for i, p in enumerate(patched):
+        pre = inserted.get(i)
+        if pre:
+            # 前插行连同本行一起输出（本行即使已为空也保留，与原先的 [new, orig] 行为一致）
+            res.extend(pre)
+            res.append(p)
+        elif p:
             res.append(p)
-        elif isinstance(p, list):
-            res.extend(p)
-        else:
-            raise TypeError(f"Unsupported patched element type: {type(p)}")
     return "\n".join(res).strip()
 
 def testing(root_test_dir: str, container) -> int:
@@ -186,22 +234,20 @@ def testing(root_test_dir: str, container) -> int:
         return -1
 
     logging.info("# Testing...")
-    signal.signal(signal.SIGALRM, timeout_handler)
-    signal.alarm(5 * 60)
     try:
-        test_result = container.exec_run(
-            "sh -c 'export JAVA_HOME=/usr/lib/jvm/java-8-openjdk-arm64 && defects4j test'",
+        res = container.exec_run(
+            f"timeout {_TEST_TIMEOUT} sh -c 'export JAVA_HOME=/usr/lib/jvm/java-8-openjdk-arm64 && defects4j test'",
             workdir=root_test_dir, stderr=True, stdout=True
-        ).output.decode('utf-8', errors='ignore')
-        signal.alarm(0)
-    except TimeoutException:
-        logging.warning("Timeout!")
-        return -1
+        )
     except Exception as e:
         logging.error(f"Errors during testing: {e}")
         return -1
+    if res.exit_code == 124:
+        logging.warning("Timeout!")
+        return -1
+    test_result = res.output.decode('utf-8', errors='ignore')
 
-    m = re.search(r'Failing tests:\s*(\d+)', test_result)
+    m = _FAILING_RE.search(test_result)
     if m:
         # 临时文件清理交给调用方自行处理；这里不删除本地文件
         return int(m.group(1))
@@ -209,41 +255,110 @@ def testing(root_test_dir: str, container) -> int:
         logging.error(f"Test results parse error\n{test_result}")
         return -1
 
-def patching_and_testing(patch: str, project_meta: dict, container_id: Optional[str] = None) -> Optional[bool]:
+@functools.lru_cache(maxsize=1)
+def _docker_client():
+    """进程内共享一个 docker 客户端（及其连接池）；SDK 不可用时返回 None。"""
+    try:
+        import docker
+    except Exception:
+        return None
+    return docker.from_env()
+
+def _put_file(container, path: str, text: str) -> None:
+    data = text.encode("utf-8")
+    info = tarfile.TarInfo(os.path.basename(path))
+    info.size = len(data)
+    info.mtime = int(time.time())  # 保证比已有 .class 新，增量编译会重新编译该文件
+    info.mode = 0o644
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        tar.addfile(info, io.BytesIO(data))
+    if not container.put_archive(os.path.dirname(path), buf.getvalue()):
+        raise RuntimeError(f"Failed to write {path} into container")
+
+def _slot_paths(project_meta: dict, slot: int) -> Tuple[str, str]:
+    """(checkout 目录, 缺陷文件) for a slot; slot 0, or a buggy file outside the checkout dir, uses the shared checkout."""
+    bug_name = f"{project_meta['project_name']}_{project_meta['buggy_number']}"
+    project_dir = os.path.join(project_meta['checkout_dir'], f"{bug_name}_buggy")
+    buggy_file = project_meta['buggy_file_path']
+    if slot and buggy_file.startswith(project_dir + os.sep):
+        slot_dir = f"{project_dir}_{slot}"
+        return slot_dir, slot_dir + buggy_file[len(project_dir):]
+    return project_dir, buggy_file
+
+def remove_slot_checkouts(project_meta: dict, container_id: Optional[str], slots: int) -> None:
+    """
+    删除 patching_and_testing 为 slot 1..slots-1 建的独立 checkout，并清掉对应的原始代码缓存。
+    每个目录先取得其锁：仍在跑的（已被放弃的）测试结束后才删除。
+    """
+    if container_id is None or slots <= 1:
+        return
+    client = _docker_client()
+    if client is None:
+        return
+    container = client.containers.get(container_id)
+    shared = _slot_paths(project_meta, 0)
+    for slot in range(1, slots):
+        project_dir, buggy_file = _slot_paths(project_meta, slot)
+        if (project_dir, buggy_file) == shared:
+            return  # 无法改写路径时各 slot 共用 checkout，不删除
+        with _CHECKOUTS_LOCK:
+            dir_lock = _DIR_LOCKS.setdefault((container_id, project_dir), threading.Lock())
+        with dir_lock:
+            container.exec_run(["rm", "-rf", project_dir], workdir="/defects4j")
+            with _CHECKOUTS_LOCK:
+                _CHECKOUTS.pop((container_id, project_dir, buggy_file), None)
+
+def patching_and_testing(patch: str, project_meta: dict, container_id: Optional[str] = None, slot: int = 0) -> Optional[bool]:
     """
     把补丁应用到目标文件并在容器里跑测试。
     - 返回 True  : 全部测试通过
     - 返回 False : 仍有失败
     - 返回 None : 补丁格式无效/无法应用
     - container_id 为 None 时，走 dry-run，直接返回 True（按“可行”占位）
+    - slot > 0 时使用独立的 checkout（<bug>_buggy_<slot>），供同一 bug 的多个候选并发测试；
+      缺陷文件不在 checkout 目录下时无法改写路径，退回共用 checkout 并串行
     """
     if container_id is None:
         logging.info("[Dry Run] Skip container-based testing, return plausible=True.")
         return True
 
-    try:
-        import docker
-    except Exception:
+    client = _docker_client()
+    if client is None:
         logging.warning("docker SDK unavailable; skip testing.")
         return None
-
-    client = docker.from_env()
     container = client.containers.get(container_id)
+    project_dir, buggy_file = _slot_paths(project_meta, slot)
 
-    main_dir = "/defects4j"
-    bug_name = f"{project_meta['project_name']}_{project_meta['buggy_number']}"
-    project_dir = os.path.join(project_meta['checkout_dir'], f"{bug_name}_buggy")
+    # 补丁只改动缺陷文件：同一 bug 的后续候选复用 checkout，用缓存的原始代码打补丁后覆盖该文件即可
+    key = (container_id, project_dir, buggy_file)
+    with _CHECKOUTS_LOCK:
+        dir_lock = _DIR_LOCKS.setdefault((container_id, project_dir), threading.Lock())
+    with dir_lock:
+        return _patch_and_test_locked(patch, project_meta, container, key)
 
-    logging.info("# Checking out...")
-    container.exec_run(f"rm -rf {project_dir}", workdir=main_dir)
-    container.exec_run(
-        f"defects4j checkout -p {project_meta['project_name']} -v {project_meta['buggy_number']}b -w {project_dir}",
-        workdir=main_dir
-    )
 
-    # 读取原代码
-    code_bytes = container.exec_run(f"cat {project_meta['buggy_file_path']}", workdir=main_dir).output
-    buggy_code = code_bytes.decode('utf-8', errors='ignore')
+def _patch_and_test_locked(patch: str, project_meta: dict, container, key: Tuple[str, str, str]) -> Optional[bool]:
+    main_dir = "/defects4j"
+    _, project_dir, buggy_file = key
+    with _CHECKOUTS_LOCK:
+        buggy_code = _CHECKOUTS.get(key)
+    if buggy_code is None:
+        logging.info("# Checking out...")
+        # 删除、checkout、读取原代码合并为一次 exec
+        res = container.exec_run(
+            ["sh", "-c",
+             f"rm -rf {project_dir}; "
+             f"defects4j checkout -p {project_meta['project_name']} -v {project_meta['buggy_number']}b -w {project_dir}"
+             f" >/dev/null 2>&1; cat {buggy_file}"],
+            workdir=main_dir
+        )
+        buggy_code = res.output.decode('utf-8', errors='ignore')
+        if res.exit_code == 0:
+            with _CHECKOUTS_LOCK:
+                _CHECKOUTS[key] = buggy_code
+    else:
+        logging.info("# Reusing checkout...")
 
     # 应用补丁
     try:
@@ -252,21 +367,8 @@ def patching_and_testing(patch: str, project_meta: dict, container_id: Optional[
         logging.warning(f"Cannot apply patch: {e}")
         return None
 
-    # 写回容器
-    import subprocess, tempfile
-    with tempfile.NamedTemporaryFile("w", delete=False, suffix=".java", encoding="utf-8") as tf:
-        tf.write(patched_code)
-        tmp_path = tf.name
-    try:
-        subprocess.run(
-            ["docker", "cp", tmp_path, f"{container_id}:{os.path.join(main_dir, project_meta['buggy_file_path'])}"],
-            check=True
-        )
-    finally:
-        try:
-            os.remove(tmp_path)
-        except Exception:
-            pass
+    # 写回容器：内存中打一个单文件 tar 经 API 上传，不再落临时文件、起 docker cp 子进程
+    _put_file(container, os.path.join(main_dir, buggy_file), patched_code)
 
     # 跑测试
     return testing(os.path.join(main_dir, project_dir), container) == 0
@@ -2,7 +2,10 @@
 import sys
 import os
 import json
+import asyncio
 import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
@@ -16,8 +19,9 @@ from src.agents.context_agent import ContextAgent
 
 from src.prompts.prepare import get_info_dict
 from src.prompts.tokens import token_limit
-from src.patch import patching_and_testing
-from src.utils import dump_exp, return_lines, write_line, json_pretty_dump, read_json
+from src.patch import patching_and_testing, remove_slot_checkouts
+from src.cache import AgentCache
+from src.utils import dump_exp, return_lines, LineAppender, json_pretty_dump, read_json, pack_json
 
 import argparse
 
@@ -29,6 +33,7 @@ parser.add_argument("--level", default=3, type=int, choices=[1, 2, 3])
 parser.add_argument("--container_id", default=None, type=str)
 parser.add_argument("--re_patch_num", default=2, type=int)
 parser.add_argument("--refinement", action="store_true")
+parser.add_argument("--agent_cache", action="store_true", help="reuse analysis-agent responses across runs on the same bugs")
 # 如需实际运行，把上面这行改为：params = vars(parser.parse_args())
 params = vars(parser.parse_args([]))
 
@@ -54,6 +59,12 @@ suffix_dict = {
     "refiner":    "patch",
 }
 
+# 每次调用都应重新采样的角色，不进 AgentCache
+sampled_roles = {"patch", "refiner"}
+
+# 容器测试专用线程池：被放弃的测试在这里跑完（docker exec 无法中途打断），不拖住 asyncio.run 的收尾
+_TEST_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="d4j-test")
+
 # 各层级流水线
 level_dict = {
     1: ["locator", "patch"],
@@ -63,7 +74,7 @@ level_dict = {
 
 
 class Pipeline:
-    def __init__(self, model_name: str, container_id, data_name, refinement=False, level=3, **kwargs):
+    def __init__(self, model_name: str, container_id, data_name, refinement=False, level=3, agent_cache=False, **kwargs):
         self.model_name = model_name
         self.container_id = None if container_id in ["None", None] else container_id
         self.data_name = data_name
@@ -76,6 +87,7 @@ class Pipeline:
         )
         self.framework = {role: role_dict[role](model_name, self.hash_id) for role in level_dict[level]}
         self.response_dir = os.path.join(f"../res/{data_name}/resp", self.hash_id)
+        self.agent_cache = AgentCache(f"../res/{data_name}/cache/agents.sqlite") if agent_cache else None
 
         os.makedirs(self.record_dir, exist_ok=True)
         self.records = {
@@ -86,27 +98,102 @@ class Pipeline:
         }
         self.messages = {}
         self.agent_resp = {}
+        # 记录文件名 -> 常驻追加器，首次写入时打开。按行缓冲：每条记录立即落盘，崩溃不丢；
+        # 多条 Pipeline 共用同一 record_dir 时各自以追加模式整行写入，也不会互相截断
+        self.appenders = {}
+
+    def append_record(self, name: str, line: str) -> None:
+        if name not in self.appenders:
+            self.appenders[name] = LineAppender(os.path.join(self.record_dir, f"{name}.txt"), buffering=1)
+        self.appenders[name].append(line)
+
+    def close(self) -> None:
+        for appender in self.appenders.values():
+            appender.close()
+        self.appenders.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def arun_agent(self, role: str, info: dict):
+        """运行 role 对应的 agent；开启 agent_cache 时，相同 bug 与上游上下文直接复用已存结果。"""
+        agent = self.framework[role]
+        if self.agent_cache is None or role in sampled_roles:
+            return await agent.arun(info, self.agent_resp)
+        key = self.agent_cache.key(role, self.model_name, info, self.agent_resp)
+        resp = self.agent_cache.get(key)
+        if resp is not None:
+            logging.info(f"[AgentCache] hit for {role}")
+            return resp
+        resp = await agent.arun(info, self.agent_resp)
+        if resp is not None:
+            self.agent_cache.set(key, resp)
+        return resp
+
+    def frozen_resp(self) -> dict:
+        """
+        agent_resp 的快照，summarizer 的结构化结果预先确定性序列化一次。
+        同一 bug 的多个补丁候选共用这一份：各自拼 prompt 时不再重复序列化，上下文字节完全一致，
+        也不会看到其他候选在 save 时写回 agent_resp 的内容。
+        """
+        pre = dict(self.agent_resp)
+        if "summarizer" in pre and not isinstance(pre["summarizer"], str):
+            pre["summarizer"] = pack_json(pre["summarizer"])
+        return pre
 
     def level_1_repair(self, info: dict, re_patch_num=3):
+        return asyncio.run(self.alevel_1_repair(info, re_patch_num=re_patch_num))
+
+    async def alevel_1_repair(self, info: dict, re_patch_num=3):
         # 定位
-        loc_response = self.framework["locator"].run(info, self.agent_resp)
+        loc_response = await self.arun_agent("locator", info)
         self.save("locator", loc_response, info['project_meta']['bug_name'])
 
-        # 反复产 patch，直到通过测试或次数用尽
+        # re_patch_num 个候选各自生成后立即在独立 checkout（slot）里测试，生成与测试全部重叠；
+        # 有一个通过即取消其余。单个候选出错（生成放弃、无回复、测试异常）只算该候选失败。
+        # 被取消的测试仍会在 _TEST_POOL 上跑完；结束后由 remove_slot_checkouts 删除各 slot 的 checkout
+        logging.info(f"Generating and testing {re_patch_num} patches concurrently")
+        loop = asyncio.get_running_loop()
+        pre = self.frozen_resp()
+
+        async def candidate(slot):
+            try:
+                fix_response = await self.framework["patch"].arun(info, pre)
+            except Exception as e:
+                logging.warning(f"Patch generation failed in slot {slot}: {e}")
+                return None, False
+            if not self.save("patch", fix_response, info['project_meta']['bug_name']):
+                return None, False
+            logging.info(f"Testing the patch in slot {slot}")
+            try:
+                ok = await loop.run_in_executor(_TEST_POOL, functools.partial(
+                    patching_and_testing,
+                    patch=fix_response["aim"],
+                    project_meta=info["project_meta"],
+                    container_id=self.container_id,
+                    slot=slot,
+                ))
+            except Exception as e:
+                logging.warning(f"Testing failed in slot {slot}: {e}")
+                ok = False
+            return fix_response, ok
+
+        tasks = [asyncio.ensure_future(candidate(slot)) for slot in range(re_patch_num)]
         last_fix = None
-        for c in range(re_patch_num):
-            logging.info(f"Generating the {c + 1}-th patch")
-            fix_response = self.framework["patch"].run(info, self.agent_resp)
-            self.save("patch", fix_response, info['project_meta']['bug_name'])
-            last_fix = fix_response
-
-            ok = patching_and_testing(
-                patch=fix_response["aim"],
-                project_meta=info["project_meta"],
-                container_id=self.container_id,
-            )
-            if ok:
-                return True, fix_response["aim"]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                fix_response, ok = await fut
+                if fix_response is not None:
+                    last_fix = fix_response
+                if ok:
+                    return True, fix_response["aim"]
+        finally:
+            for t in tasks:
+                t.cancel()
+            _TEST_POOL.submit(remove_slot_checkouts, info["project_meta"], self.container_id, re_patch_num)
 
         return False, (last_fix["aim"] if last_fix else "")
 
@@ -117,7 +204,7 @@ class Pipeline:
         os.makedirs(os.path.join(self.response_dir, role, "ori"), exist_ok=True)
 
         if response_dict is None:
-            write_line(os.path.join(self.record_dir, "failed_lst.txt"), bug_name)
+            self.append_record("failed_lst", bug_name)
             self.messages[role] = ""
             return False
 
@@ -125,11 +212,8 @@ class Pipeline:
             cur_s = "txt"
             if k == "aim":
                 cur_s = suffix
-                # 只把 summarizer 的结构化结果放到后续 agent 共享上下文里
-                if role == "summarizer":
-                    self.agent_resp[role] = json.dumps(v)
-                else:
-                    self.agent_resp[role] = v
+                # summarizer 的结构化结果原样（dict）放进共享上下文，由 Agent._shared_msg 在拼 prompt 时序列化
+                self.agent_resp[role] = v
 
             out_path = os.path.join(self.response_dir, role, k[:3], f"{bug_name}.{cur_s}")
             if cur_s == "json":
@@ -149,7 +233,7 @@ class Pipeline:
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
-    workpipe = Pipeline(**params)
-    # 示例：这里不直接跑数据集循环，避免依赖你们的数据载入器
-    # work_num, plau_num = workpipe.looping(**params)
-    logging.info(f"{workpipe.hash_id} Pipeline initialized for model={params['model_name']} level={params['level']}.")
+    with Pipeline(**params) as workpipe:
+        # 示例：这里不直接跑数据集循环，避免依赖你们的数据载入器
+        # work_num, plau_num = workpipe.looping(**params)
+        logging.info(f"{workpipe.hash_id} Pipeline initialized for model={params['model_name']} level={params['level']}.")
@@ -1,4 +1,8 @@
 import os
+import re
+import json
+import functools
+from bisect import bisect_left, bisect_right
 from ..utils import *
 from ..prompts.tokens import *
 
@@ -15,11 +19,15 @@ failing_test_cases: Test code that triggers the bug.
 buggy_code: The file content of buggy_file_path.
 packages: The content starting with import or packages in the buggy code. 
 '''
+@functools.lru_cache(maxsize=4096)
 def exist_java(dir_path):
-    for file in os.listdir(dir_path):
-        if file.endswith(".java"):
-            return True
-        
+    """目录下是否直接含有 .java 文件；scandir 惰性遍历，命中即停。同一项目的候选目录反复出现，故缓存。"""
+    try:
+        with os.scandir(dir_path) as it:
+            return any(entry.name.endswith(".java") for entry in it)
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+
 # import javalang
 # def get_func_code_in_test(test_path, func):
 #     with open(test_path) as tf:
@@ -45,42 +53,70 @@ def exist_java(dir_path):
 #     return func_code
 
 
-def get_failing_info(project_dir, model_name):
-    
+# 测试方法的起点候选行：向上回溯到最近的 assert/public/private 行为止
+_BOUNDARY_RE = re.compile(r'assert|public|private')
+
+
+def _boundary_lines(lines):
+    return [i for i, line in enumerate(lines) if _BOUNDARY_RE.search(line)]
+
+
+def _decode(blob):
+    """按文本模式打开时的方式解码：UTF-8，并把 \\r\\n / \\r 统一成 \\n。"""
+    return blob.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def get_failing_info(project_dir, model_name, failing_tests=None):
+    """failing_tests 为 failing_tests 文件内容，已读入时传入以免重复读盘。"""
+
     for test_file in ["tests", "test", "src/test/org", "src/test/java", "gson/src/test/java"]:
         if os.path.exists(f"{project_dir}/{test_file}"):
             test_file_path = test_file if test_file != "src/test/org" else "src/test"
 
     assert os.path.exists(os.path.join(project_dir, test_file_path)), "\n".join(os.listdir(project_dir))
-    failing_test_cases = ""
-    testing_error = ""
-    with open(os.path.join(project_dir, "failing_tests")) as rf:
-        failing_info = rf.read().splitlines()
+    failing_test_cases = []
+    if failing_tests is None:
+        with open(os.path.join(project_dir, "failing_tests")) as rf:
+            failing_tests = rf.read()
+    failing_info = failing_tests.splitlines()
 
-    ori_path, test_code = None, None
-    testing_error = ""
+    # 涉及的测试文件先一次性并发读入，每个只读一次并预先算好边界行；之后每次命中都拷贝一份，保证注入的报错互不影响
+    blobs = read_many([
+        os.path.join(project_dir, test_file_path, os.sep.join(l.replace("--- ", "").split("::")[0].split(".")) + ".java")
+        for l in failing_info if l.startswith("--- ")
+    ])
+    loaded = {}
+    ori_path, test_code, bounds = None, None, None
+    testing_error = []
     for l in failing_info:
         if l.startswith("--- "):
             ori_path, func = l.replace("--- ", "").split("::")
-            path = os.sep.join(ori_path.split(".")) + ".java"
-            if os.path.exists(os.path.join(project_dir, test_file_path, path)):
-                with open(os.path.join(project_dir, test_file_path, path)) as rf:
-                    test_code = rf.read().splitlines()
-        
+            path = os.path.join(project_dir, test_file_path, os.sep.join(ori_path.split(".")) + ".java")
+            if path not in loaded and blobs.get(path) is not None:
+                lines = _decode(blobs[path]).splitlines()
+                loaded[path] = (lines, _boundary_lines(lines))
+            if path in loaded:
+                test_code, bounds = list(loaded[path][0]), list(loaded[path][1])
+
         if not l.strip().startswith("at "):
-            testing_error += l + "\n"
+            testing_error.append(l + "\n")
         elif ori_path is not None and test_code is not None and (ori_path+"."+func).strip() in l:
             line_idx = int(l.split(":")[-1].strip().strip(")")) - 1
-            i = line_idx - 1
-            while i >= 0:
-                if "assert" in test_code[i] or "public" in test_code[i] or "private" in test_code[i]:
-                    break    
-                i -= 1
-            test_code[line_idx] += "\n/*\n" + testing_error + "*/"
-            testing_error = ""
-            failing_test_cases += f"public void {func}" + "{\n" + "\n".join([c for c in test_code[i + 1: line_idx + 1] if len(c.strip()) > 0]) + "\n}"
+            # 最近的 <= line_idx - 1 的边界行，没有则为 -1
+            pos = bisect_right(bounds, line_idx - 1)
+            i = bounds[pos - 1] if pos else -1
+            test_code[line_idx] += "\n/*\n" + "".join(testing_error) + "*/"
+            # 注入的报错文本可能让该行变成新的边界行；行号为 0 时 line_idx 为 -1，上面写入的是最后一行
+            j = line_idx if line_idx >= 0 else len(test_code) + line_idx
+            k = bisect_left(bounds, j)
+            if (k == len(bounds) or bounds[k] != j) and _BOUNDARY_RE.search(test_code[j]):
+                bounds.insert(k, j)
+            testing_error = []
+            failing_test_cases.append(
+                f"public void {func}" + "{\n" + "\n".join([c for c in test_code[i + 1: line_idx + 1] if len(c.strip()) > 0]) + "\n}"
+            )
 
-    return failing_test_cases
+    return "".join(failing_test_cases)
 
 def print_info_tokens(info):
     print("Tokens of info:")
@@ -90,7 +126,47 @@ def print_info_tokens(info):
     print(info["failing_test_cases"])
     print()
 
-def get_info_dict(checkout_dir: str, bug_name: str, model_name: str, root_causes: dict=None):
+def _input_paths(project_dir: str, root_cause: str):
+    """get_info_dict 直接读取的各输入文件，顺序固定（_info_key 依赖此顺序）。"""
+    return [os.path.join(project_dir, root_cause), os.path.join(project_dir, "failing_tests"),
+            os.path.join(project_dir, "coverage_report.txt"), os.path.join(project_dir, "coverage_indices.txt")]
+
+
+def _info_key(bug_name: str, model_name: str, root_cause: str, blobs: dict) -> str:
+    """
+    get_info_dict 的内容哈希键：bug、模型与根因路径，加上它直接读取的各输入文件内容（blobs 由 read_many 读入）。
+    测试源码由 checkout 决定，不单独计入。
+    """
+    return content_hash(bug_name, model_name, root_cause, *blobs.values())
+
+
+def get_info_dict(checkout_dir: str, bug_name: str, model_name: str, root_causes: dict=None, cache_dir: str=None):
+    """
+    cache_dir 若给出，结果按 _info_key 存为 <cache_dir>/<hash>.json，输入不变时直接读回。
+    """
+    if root_causes is None:
+        root_causes = read_json(os.path.join(checkout_dir, "root_cause_path.json"))
+
+    # 输入文件一次性并发读入，缓存键与构建共用同一份内容
+    project_dir = os.path.join(checkout_dir, f"{bug_name}_buggy")
+    blobs = read_many(_input_paths(project_dir, root_causes[bug_name]))
+
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, _info_key(bug_name, model_name, root_causes[bug_name], blobs) + ".json")
+        if os.path.exists(cache_path):
+            info = read_json(cache_path)
+            print_info_tokens(info)
+            return info
+
+    info = _build_info_dict(checkout_dir, bug_name, model_name, root_causes, blobs)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as wf:
+            json.dump(info, wf, ensure_ascii=False)
+    return info
+
+
+def _build_info_dict(checkout_dir: str, bug_name: str, model_name: str, root_causes: dict, blobs: dict):
     [project_name, buggy_number] = bug_name.split("_")
     info = {
         "project_meta": {
@@ -100,9 +176,6 @@ def get_info_dict(checkout_dir: str, bug_name: str, model_name: str, root_causes
             "bug_name": bug_name
         },
     }
-    if root_causes is None:
-        root_causes = read_json(os.path.join(checkout_dir, "root_cause_path.json"))
-
     project_dir = os.path.join(checkout_dir, f"{bug_name}_buggy") 
     info["project_meta"]["buggy_file_path"] = os.path.join(project_dir, root_causes[bug_name])
     
@@ -113,21 +186,28 @@ def get_info_dict(checkout_dir: str, bug_name: str, model_name: str, root_causes
             info["project_meta"]["project_src_path"] = src_dir
             break
 
-    with open(info["project_meta"]["buggy_file_path"]) as rf:
-        info["raw_code"] = rf.read()
+    buggy_path, failing_path, report_path, indices_path = _input_paths(project_dir, root_causes[bug_name])
+    if blobs[buggy_path] is None:
+        raise FileNotFoundError(buggy_path)
+    info["raw_code"] = _decode(blobs[buggy_path])
     
-    if os.path.exists(os.path.join(project_dir, "coverage_report.txt")):
-        with open(os.path.join(project_dir, "coverage_report.txt")) as rf:
-            info["coverage_report"] = rf.read()
+    if blobs[report_path] is not None:
+        info["coverage_report"] = _decode(blobs[report_path])
     
-    info["buggy_code"] = shorten(info["raw_code"], token_limit[model_name]["buggy_code"], 
-                                 return_lines(os.path.join(project_dir, "coverage_indices.txt"))
-    )
+    coverage = []
+    if blobs[indices_path] is not None:
+        # 与 return_lines 相同：按 \n 切分并去掉末尾空行
+        coverage = _decode(blobs[indices_path]).split("\n")
+        if coverage[-1] == "":
+            coverage.pop()
+    # 源码只切分一次，shorten 与 packages 共用
+    lines = info["raw_code"].splitlines()
+    info["buggy_code"] = shorten(info["raw_code"], token_limit[model_name]["buggy_code"], coverage, lines=lines)
     
-    info["packages"] = "\n".join([l for l in info["raw_code"].splitlines() 
-                                if l.strip().startswith("import") or l.strip().startswith("package")])
+    info["packages"] = "\n".join([l for l in lines if l.lstrip().startswith(("import", "package"))])
     
-    info["failing_test_cases"] = get_failing_info(project_dir, model_name)
+    failing_tests = _decode(blobs[failing_path]) if blobs[failing_path] is not None else None
+    info["failing_test_cases"] = get_failing_info(project_dir, model_name, failing_tests)
     
     print_info_tokens(info)
     return info
@@ -12,6 +12,7 @@ token_limit = {
 }
 
 def calculate_token(*args):
+    # 按字符数估算（约 4 字符/token），可加：calculate_token(a, b) == calculate_token(a + b)
     lenth = 0
     for v in args:
         if isinstance(v, int):
@@ -22,27 +23,31 @@ def calculate_token(*args):
             lenth += sum([len(vd["content"]) for vd in v])
     return lenth // 4
 
-def shorten(ori_text:str, aim_token:int, coverage=list[int]):
-    if calculate_token(ori_text) <= aim_token:
+def shorten(ori_text:str, aim_token:int, coverage=list[int], lines=None):
+    # lines: 调用方已有的 ori_text.splitlines()，传入可省去再次切分
+    ori_tokens = calculate_token(ori_text)
+    if ori_tokens <= aim_token:
         return ori_text
     ori_lenth = len(ori_text)
-    print("Cutting from", calculate_token(ori_text))
+    print("Cutting from", ori_tokens)
     
     text = remove_comment(ori_text)
     print("1st shorten: remove comments...", ori_lenth, "->", len(text))
 
     if calculate_token(text) > aim_token:
-        tmp = []
-        for line in text.splitlines():
-            if not line.startswith("import") or len(line.strip()) < 1:
-                tmp.append(line.strip())
-        text = "\n".join(tmp)
-        print("2nd shorten: remove packages...", ori_lenth, "->", len(text))
+        # 以 import 开头的行必然非空，原先的空行判断是多余的
+        kept = [line.strip() for line in text.splitlines() if not line.startswith("import")]
+        # 拼接前先由各行长度算出结果长度：仍超预算且有覆盖信息时这段文本会被第 3 步替换，不必拼接
+        size = sum(map(len, kept)) + max(len(kept) - 1, 0)
+        print("2nd shorten: remove packages...", ori_lenth, "->", size)
+        text = None if size // 4 > aim_token and len(coverage) > 0 else "\n".join(kept)
     
-    if calculate_token(text) > aim_token:
+    if text is None or calculate_token(text) > aim_token:
         if len(coverage) > 0:
             s, e = min(coverage), max(coverage)
-            text = remove_comment("\n".join(ori_text.splitlines()[s-1: e]))
+            if lines is None:
+                lines = ori_text.splitlines()
+            text = remove_comment("\n".join(lines[s-1: e]))
         print("3rd only keep executed code...", ori_lenth, "->", len(text))
     
     return text
\ No newline at end of file
@@ -1,7 +1,9 @@
 # unit_test.py
 import os
 import sys
+import copy
 import json
+import asyncio
 import logging
 import argparse
 
@@ -32,16 +34,30 @@ def test_summarizer(model_name, info):
     from src.agents.summarizer import Summarizer
     bug_related = return_lines("../unit/aim_save/focus.txt")
     agent = Summarizer(model_name, hash_id="unittest")
-    summary = {}
+    codes = {}
     for f in bug_related:
         if not f.endswith(".java"):
             continue
         fpath = os.path.join(info["project_meta"]["project_src_path"], f)
         if os.path.exists(fpath):
             with open(fpath, encoding="utf-8") as rf:
-                code = rf.read()
-            resp = agent.run(code)
-            summary[f] = resp["aim"]
+                codes[f] = rf.read()
+
+    # 按 token 预算把文件装箱，每箱一次打包请求共享 system prompt；各箱互不依赖，限流并发请求
+    async def summarize_all(limit=8):
+        sem = asyncio.Semaphore(limit)
+
+        async def one(names):
+            async with sem:
+                results = await asyncio.to_thread(copy.copy(agent).run_batch, [codes[n] for n in names])
+                return dict(zip(names, (r["aim"] for r in results)))
+
+        return await asyncio.gather(*(one(names) for names in agent.pack(codes)))
+
+    merged = {}
+    for part in asyncio.run(summarize_all()):
+        merged.update(part)
+    summary = {f: merged[f] for f in codes}
     _ensure_dirs()
     json_pretty_dump(summary, "../unit/aim_save/summarizer.json")
     _save_ori("summarizer", json.dumps(summary, ensure_ascii=False))
@@ -56,7 +72,7 @@ def test_slicer(model_name, info):
         with open("../unit/aim_save/context.txt", encoding="utf-8") as rf:
             pre["helper"] = rf.read()
     if os.path.exists("../unit/aim_save/summarizer.json"):
-        pre["summarizer"] = json.dumps(read_json("../unit/aim_save/summarizer.json"))
+        pre["summarizer"] = read_json("../unit/aim_save/summarizer.json")
 
     resp = agent.run(info, pre_agent_resp=pre)
     _ensure_dirs()
@@ -78,7 +94,7 @@ def test_locator(model_name, info):
         with open("../unit/aim_save/context.txt", encoding="utf-8") as rf:
             pre["helper"] = rf.read()
     if os.path.exists("../unit/aim_save/summarizer.json"):
-        pre["summarizer"] = json.dumps(read_json("../unit/aim_save/summarizer.json"))
+        pre["summarizer"] = read_json("../unit/aim_save/summarizer.json")
 
     resp = agent.run(info, pre_agent_resp=pre)
     _ensure_dirs()
@@ -98,7 +114,7 @@ def test_patch(model_name, info):
         with open("../unit/aim_save/context.txt", encoding="utf-8") as rf:
             pre["helper"] = rf.read()
     if os.path.exists("../unit/aim_save/summarizer.json"):
-        pre["summarizer"] = json.dumps(read_json("../unit/aim_save/summarizer.json"))
+        pre["summarizer"] = read_json("../unit/aim_save/summarizer.json")
 
     resp = agent.run(info, pre_agent_resp=pre)
     _ensure_dirs()
@@ -128,7 +144,7 @@ def test_refiner(model_name, info, container_id):
         with open("../unit/aim_save/context.txt", encoding="utf-8") as rf:
             pre["helper"] = rf.read()
     if os.path.exists("../unit/aim_save/summarizer.json"):
-        pre["summarizer"] = json.dumps(read_json("../unit/aim_save/summarizer.json"))
+        pre["summarizer"] = read_json("../unit/aim_save/summarizer.json")
 
     agent = PatchRefiner(model_name, hash_id="unittest")
     resp = agent.run(
@@ -180,6 +196,7 @@ if __name__ == "__main__":
         bug_name="Lang_1",
         model_name=args.model_name,
         root_causes={"Lang_1": "src/main/java/org/apache/commons/lang3/math/NumberUtils.java"},
+        cache_dir="../unit/info_cache",
     )
 
     if args.test == "context":    test_context(info)
@@ -2,9 +2,26 @@ import os
 import json
 import logging
 import hashlib
+import functools
 import yaml
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Tuple, Optional
 
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    _HAS_ORJSON = False
+
+try:
+    import blake3
+    _HAS_BLAKE3 = True
+except Exception:
+    _HAS_BLAKE3 = False
+
+# libyaml 的 C 实现可用时用它解析，结果与纯 Python 的 SafeLoader 相同
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 # ---------------- I/O helpers ----------------
 
@@ -41,7 +58,16 @@ def read_yaml(file_path: str) -> Any:
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"YAML not found: {file_path}")
     with open(file_path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)  # may return dict/list/None
+        return yaml.load(f, Loader=_YamlLoader)  # may return dict/list/None
+
+
+@functools.lru_cache(maxsize=None)
+def load_prompts(file_path: str) -> Any:
+    """
+    read_yaml 的缓存版本，用于运行期不会变化的 prompts/*.yaml。
+    返回对象在调用方之间共享，请只读使用。
+    """
+    return read_yaml(file_path)
 
 
 def get_content(file_path: str) -> Dict[str, str]:
@@ -65,23 +91,67 @@ def read_json(filepath: str) -> Any:
         raise FileNotFoundError(f"File not exists: {filepath}")
     if not filepath.endswith(".json"):
         raise ValueError(f"Not a .json file: {filepath}")
+    if _HAS_ORJSON:
+        with open(filepath, "rb") as f:
+            data = f.read()
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson 不接受的输入（如 NaN/Infinity）交给标准库重试，真正的格式错误也照原样报出
+            return json.loads(data.decode("utf-8"))
     with open(filepath, "r", encoding="utf-8") as f:
         return json.load(f)
 
 
 def json_pretty_dump(obj: Any, filename: str) -> None:
     _ensure_parent_dir(filename)
+    if _HAS_ORJSON:
+        # orjson 直接产出 UTF-8 字节（C 实现），缩进为 2；含其不支持的类型时退回标准库。
+        # 注意 orjson 把 NaN/Infinity 写成 null，标准库写成 NaN/Infinity
+        try:
+            data = orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            data = None
+        if data is not None:
+            with open(filename, "wb") as fw:
+                fw.write(data)
+            return
     with open(filename, "w", encoding="utf-8", newline="") as fw:
         json.dump(
             obj,
             fw,
             sort_keys=True,
-            indent=4,
+            indent=2,  # 与 orjson 分支一致，输出不随是否装了 orjson 而变
             separators=(",", ": "),
             ensure_ascii=False,
         )
 
 
+def pack_json(obj: Any) -> str:
+    """
+    紧凑且确定的 JSON 文本（键排序、无多余空白），用于拼进 prompt 的结构化上下文：
+    内容相同则字节相同，provider 的前缀缓存与本地响应缓存都能命中。
+    """
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def content_hash(*parts: Any) -> str:
+    """
+    缓存键用的内容哈希（64 位十六进制）：str 按 UTF-8 编码；每部分前加存在标记（None 为 \\x00，
+    否则为 \\x01 加 8 字节长度），None 与空内容、以及不同的切分方式都不会得到相同的键。
+    有 blake3 时用其 SIMD 实现，否则退回 blake2b；两者的键互不相同，换环境后缓存会重新生成。
+    """
+    h = blake3.blake3() if _HAS_BLAKE3 else hashlib.blake2b(digest_size=32)
+    for part in parts:
+        if part is None:
+            h.update(b"\x00")
+            continue
+        data = part.encode("utf-8") if isinstance(part, str) else part
+        h.update(b"\x01" + len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
 # ---------------- logging & experiment ----------------
 
 def logging_activate(record_dir: str) -> None:
@@ -123,13 +193,64 @@ def dump_exp(result_save_dir: str, params: Dict[str, Any]) -> Tuple[str, str]:
 
 def return_lines(file_path: str) -> List[str]:
     if os.path.exists(file_path) and os.path.isfile(file_path):
+        # 一次读入再切分，结果与逐行 readlines + rstrip("\n") 相同
         with open(file_path, "r", encoding="utf-8") as rf:
-            return [ln.rstrip("\n") for ln in rf.readlines()]
+            lines = rf.read().split("\n")
+        if lines[-1] == "":
+            lines.pop()
+        return lines
     return []
 
 
+def _read_bytes(file_path: str) -> Optional[bytes]:
+    try:
+        with open(file_path, "rb") as rf:
+            return rf.read()
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+
+
+def read_many(paths: List[str], max_workers: int = 8) -> Dict[str, Optional[bytes]]:
+    """
+    并发读入一批小文件（冷页缓存时各次 read 可在内核侧重叠），返回 {path: bytes}；
+    不存在或不是普通文件的路径对应 None。重复路径只读一次。
+    """
+    uniq = list(dict.fromkeys(paths))
+    if len(uniq) <= 1:
+        return {p: _read_bytes(p) for p in uniq}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(uniq))) as ex:
+        return dict(zip(uniq, ex.map(_read_bytes, uniq)))
+
+
 def write_line(file_path: str, line: str) -> None:
     _ensure_parent_dir(file_path)
     with open(file_path, "a", encoding="utf-8", newline="") as wf:
         wf.write(line + "\n")
 
+
+class LineAppender:
+    """
+    write_line 的常驻版本：文件只打开一次，追加的行先进缓冲区，flush/close 时落盘。
+    可用作上下文管理器。
+    """
+
+    def __init__(self, file_path: str, buffering: int = 8192) -> None:
+        _ensure_parent_dir(file_path)
+        self.file_path = file_path
+        self._wf = open(file_path, "a", encoding="utf-8", newline="", buffering=buffering)
+
+    def append(self, line: str) -> None:
+        self._wf.write(line + "\n")
+
+    def flush(self) -> None:
+        self._wf.flush()
+
+    def close(self) -> None:
+        self._wf.close()
+
+    def __enter__(self) -> "LineAppender":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+